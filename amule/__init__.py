@@ -15,19 +15,85 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-__all__ = ['eccodes', 'ectag', 'ecpacket', 'ecpacketutils']
+__all__ = ['eccodes', 'ectag', 'ecpacket', 'ecpacketutils', 'eccache',
+           'eccapture', 'ecdecoder', 'ecmetrics', 'ecprofile', 'ecstrings',
+           'ecworker', 'ed2k', 'eclist', 'ecstats', 'mockserver', 'pool',
+           'search', 'snapshot', 'analytics', 'coalesce']
 
-import hashlib
+import copy
 import socket
+import struct
+import time
 
 from eccodes import *
 from ectag import *
-from ecpacket import ECPacket
+from ecpacket import ECPacket, ECFrameLimits, ECFrameTooLargeError, \
+                        ec_check_frame, ec_frame_appdata, ec_read_data
+from eccache import ECLRUCache
+from eccapture import ECCaptureWriter, CAPTURE_SENT, CAPTURE_RECV
+from ecdecoder import compile_plan, decode_prefs, pref_key, PREFS_SECTIONS
+from eclist import ECListView, ECListDesyncError
+from ecstrings import ECStringTable, ec_text
 
 
+# Beginning of the message sent by amuled when a search started
+SEARCH_STARTED = "Search in progress"
+
 class ECError(Exception): pass
 class ECConnectionError(ECError): pass
 
+class ECBulkError(ECError):
+    """Errors raised while sending some chunks of a bulk command
+
+    results holds the per-item outcome of the command (False for items of
+    failed chunks) and errors the exception raised for each failed item.
+
+    """
+
+    def __init__(self, results, errors):
+        first = errors.values()[0]
+        ECError.__init__(self, "%d of %d items failed: %s" % (len(errors),
+                            len(results), first))
+        self.results = results
+        self.errors = errors
+
+def _split_tags(tags, max_tags, max_bytes):
+    """Split a list of tags into chunks
+
+    Each chunk holds at most max_tags tags and at most max_bytes bytes of
+    encoded tag data (but always at least one tag).
+
+    """
+
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for tag in tags:
+        size = tag.size()
+        if chunk and (len(chunk) >= max_tags or
+                            chunk_bytes + size > max_bytes):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(tag)
+        chunk_bytes = chunk_bytes + size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def server_score(item):
+    """Score a server list item for server selection
+    
+    Favor servers with many users and a low ping, and penalize servers with
+    failed connection attempts.  Unknown pings (0) count as 500ms.
+    
+    """
+    
+    ping = item.get('ping') or 500
+    users = item.get('users') or 0
+    failed = item.get('failed') or 0
+    return users / (1.0 + ping / 100.0) / (1 + failed) ** 2
+
 class _NotConnectedFile:
     def __getattr__(self, attr):
         return self._dummy
@@ -35,6 +101,42 @@ class _NotConnectedFile:
     def _dummy(*args):
         raise ECConnectionError("Not connected")
 
+class _DeferredFrame:
+    """Undecoded response frame, see AmuleClient._readpacket()"""
+
+    def __init__(self, flags, data):
+        self.flags = flags
+        self.data = data
+
+class ECListResult:
+    """Result of a list request made with deferred = True
+
+    The response has been received, but may still be being decoded by decode
+    workers (see AmuleClient.set_decode_workers()).  get() returns the list,
+    waiting at most timeout seconds for decoding to finish when given (and
+    raising multiprocessing.TimeoutError after that).
+
+    """
+
+    def __init__(self, source = None, finish = None, value = None):
+        self._source = source
+        self._finish = finish
+        self._value = value
+
+    def ready(self):
+        """Return True if get() will not wait"""
+        return self._source is None or self._source.ready()
+
+    def get(self, timeout = None):
+        if self._source is not None:
+            value = self._source.get(timeout)
+            if self._finish is not None:
+                value = self._finish(value)
+            self._value = value
+            self._source = None
+            self._finish = None
+        return self._value
+
 class AmuleClient:
 
     #
@@ -42,6 +144,23 @@ class AmuleClient:
     #
 
     def __init__(self):
+        self.downloads = ECListView()
+        self.shared = ECListView()
+        self.uploads = ECListView()
+        self.waiting = ECListView()
+        self.servers = ECListView()
+        self.details_cache = ECLRUCache(64, 30)
+        self._log_state = {}
+        self._prefs_cache = {}
+        self._plans = {}
+        self._hooks = []
+        self._request_info = None
+        self._capture = None
+        self.tag_profile = None
+        self._decode_workers = None
+        self._decode_threshold = None
+        self._frame_limits = None
+        self.string_table = ECStringTable()
         self._reset()
 
     def _reset(self):
@@ -59,14 +178,226 @@ class AmuleClient:
         self._wfile = _NotConnectedFile()
         self._rfile = _NotConnectedFile()
 
+    def add_hook(self, hook):
+        """Register a request hook
+        
+        hook is notified of each request made to amuled, with timings and
+        sizes (see ecmetrics.ECHook).
+        
+        """
+        
+        self._hooks.append(hook)
+        
+    def remove_hook(self, hook):
+        """Unregister a request hook"""
+        self._hooks.remove(hook)
+
+    def start_capture(self, path):
+        """Capture raw frames to path
+        
+        Every frame sent to or received from amuled is appended to the capture
+        file at path (see eccapture).  Start capture before connect() to
+        include authentication frames.
+        
+        """
+        
+        self.stop_capture()
+        self._capture = ECCaptureWriter(path)
+        
+    def stop_capture(self):
+        """Stop capturing frames"""
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
+    def start_tag_profile(self):
+        """Start accounting for decoding costs by tag name
+        
+        Return an ecprofile.ECTagProfile (also available as self.tag_profile)
+        that accumulates costs of all responses until stop_tag_profile() is
+        called.
+        
+        """
+        
+        from ecprofile import ECTagProfile
+        
+        self.tag_profile = ECTagProfile(self.codes)
+        return self.tag_profile
+        
+    def stop_tag_profile(self):
+        """Stop accounting for decoding costs, return the profile"""
+        profile = self.tag_profile
+        self.tag_profile = None
+        return profile
+
     def _writepacket(self, packet):
         """Send a packet to amuled"""
-        self._wfile.write(packet.get_raw_packet(self.codes))
+        raw = packet.get_raw_packet(self.codes)
+        if not self._hooks and self._capture is None:
+            self._wfile.write(raw)
+            self._wfile.flush()
+            return
+            
+        start = time.time()
+        self._wfile.write(raw)
         self._wfile.flush()
+        write_s = time.time() - start
+        
+        if self._capture is not None:
+            self._capture.write(CAPTURE_SENT, start, self.protocol_version, raw)
+        if not self._hooks:
+            return
+            
+        self._request_info = {
+            'opcode': packet.opcode,
+            'opcode_name': self.codes.opcode_name(packet.opcode) or
+                                        "0x%02x" % packet.opcode,
+            'bytes_sent': len(raw),
+            'bytes_sent_raw': 8 + packet.appdata_len,
+            'write_s': write_s
+        }
+        
+    def set_decode_workers(self, workers, threshold = 1048576):
+        """Decode large list responses with workers
+        
+        List responses whose frames are at least threshold bytes long are
+        decompressed, parsed and mapped by workers (an ecworker.ECDecodeWorkers
+        instance) instead of the calling thread.  Pass None to decode all
+        responses locally again.  Responses are always decoded locally while
+        tag profiling is enabled.
+        
+        """
+        
+        self._decode_workers = workers
+        self._decode_threshold = threshold
+
+    def set_frame_limits(self, max_frame = None, max_appdata = None,
+                            spill_size = None, spill_dir = None):
+        """Bound memory used by responses
+        
+        Responses larger than max_frame bytes as received, or than max_appdata
+        bytes once decompressed, raise ECFrameTooLargeError (the connection is
+        closed when max_frame is exceeded, as the rest of the frame is not
+        read).  Frames larger than spill_size bytes are written to a temporary
+        file in spill_dir which is memory-mapped for decoding.  Compressed
+        frames are decompressed piecewise when any limit is set.
         
-    def _readpacket(self):
-        """Receive a packet from amuled"""
-        return ECPacket(self.codes, buffer = self._rfile)
+        Call without arguments to remove limits.
+        
+        """
+        
+        if max_frame is None and max_appdata is None and spill_size is None:
+            self._frame_limits = None
+        else:
+            self._frame_limits = ECFrameLimits(max_frame, max_appdata,
+                                                spill_size, spill_dir)
+
+    def _readframe(self):
+        """Receive a raw frame from amuled, return (flags, data)"""
+        limits = self._frame_limits
+        start = time.time()
+        header = self._rfile.read(8)
+        head_t = time.time()
+        flags, msg_len = struct.unpack("!II", header)
+        try:
+            ec_check_frame(msg_len, limits)
+        except ECFrameTooLargeError:
+            self.disconnect()
+            raise
+        data = ec_read_data(self._rfile, msg_len, limits)
+        read_t = time.time()
+        
+        if self._capture is not None:
+            self._capture.write(CAPTURE_RECV, head_t, self.protocol_version,
+                                header, data)
+            self._capture.flush()
+        if self._hooks:
+            info = self._request_info or {'opcode': None, 'opcode_name': None,
+                    'bytes_sent': 0, 'bytes_sent_raw': 0, 'write_s': 0.0}
+            info.update({
+                'bytes_recv': 8 + len(data),
+                'wait_s': head_t - start,
+                'read_s': read_t - head_t
+            })
+            self._request_info = info
+        return (flags, data)
+        
+    def _request_done(self, resp_opcode, info = None, **stats):
+        """Notify hooks of a finished request
+        
+        info defaults to the pending request information, which is then
+        cleared.
+        
+        """
+        
+        if info is None:
+            info = self._request_info
+            self._request_info = None
+        info.update(stats)
+        info['resp_opcode'] = resp_opcode
+        info['resp_opcode_name'] = self.codes.opcode_name(resp_opcode) or \
+                                        "0x%02x" % resp_opcode
+        for hook in self._hooks:
+            hook.on_request(self, info)
+        
+    def _readpacket(self, deferred = False):
+        """Receive a packet from amuled
+        
+        When deferred is True and decode workers are set (see
+        set_decode_workers()), large frames are returned undecoded as
+        _DeferredFrame objects, to be handed to workers by _list_decoder().
+        
+        """
+        
+        workers = self._decode_workers
+        if deferred and workers is not None and self.tag_profile is None:
+            flags, data = self._readframe()
+            if len(data) >= self._decode_threshold and \
+                    isinstance(data, str):
+                return _DeferredFrame(flags, data)
+            return self._decodeframe(flags, data)
+            
+        if not self._hooks and self._capture is None and \
+                self._frame_limits is None:
+            return ECPacket(self.codes, buffer = self._rfile,
+                            profile = self.tag_profile,
+                            strings = self.string_table)
+        
+        flags, data = self._readframe()
+        return self._decodeframe(flags, data)
+        
+    def _decodeframe(self, flags, data):
+        """Decode a frame received with _readframe()"""
+        limits = self._frame_limits
+        if not self._hooks:
+            return ECPacket(self.codes, appdata = (flags,
+                                ec_frame_appdata(self.codes, flags, data,
+                                                    limits)),
+                            profile = self.tag_profile,
+                            strings = self.string_table)
+            
+        start = time.time()
+        appdata = ec_frame_appdata(self.codes, flags, data, limits)
+        decompress_t = time.time()
+        packet = ECPacket(self.codes, appdata = (flags, appdata),
+                            profile = self.tag_profile,
+                            strings = self.string_table)
+        decode_t = time.time()
+        
+        def count_tags(tags):
+            count = len(tags)
+            for t in tags:
+                if t.subtags:
+                    count = count + count_tags(t.subtags)
+            return count
+        
+        self._request_done(packet.opcode,
+            bytes_recv_raw = 8 + len(appdata),
+            tags = count_tags(packet.tags),
+            decompress_s = decompress_t - start,
+            decode_s = decode_t - decompress_t
+        )
+        return packet
         
     def _authenticate(self, vers, password, client_name, client_version):
         """Authenticate with amuled
@@ -81,8 +412,10 @@ class AmuleClient:
         
         """
         
+        import hashlib
+
         self.protocol_version = vers
-        self.codes = ECCodes(vers)
+        self.codes = ec_get_codes(vers)
     
         pass_md5 = hashlib.md5(password).hexdigest()
         req_packet = ECPacket(self.codes, opcode = self.codes.OP_AUTH_REQ)
@@ -162,7 +495,9 @@ class AmuleClient:
         Try to create a socket with amuled, as well as read/write buffers from
         this socket.  When successful, run authenticate handshake with amuled.
         
-        Raises ECConnectionError or socket.error on failure.
+        Raises ECConnectionError or socket.error on failure, or
+        ECFrameTooLargeError when a response exceeds frame limits (see
+        set_frame_limits()).
         
         """
         ok = False
@@ -171,6 +506,10 @@ class AmuleClient:
             try:
                 ok = self._authenticate(vers, password, client_name,
                     client_version)
+            except ECFrameTooLargeError:
+                # Do not hide it behind an authentication failure
+                self.disconnect()
+                raise
             except:
                 self.disconnect()
             else:
@@ -185,10 +524,13 @@ class AmuleClient:
     def disconnect(self):
         """Disconnect from amuled
         
-        Close connection socket and reset the client status.
+        Close connection socket and reset the client status.  Does nothing
+        when not connected.
         
         """
         
+        if self._socket is None:
+            return
         self._wfile.close()
         self._rfile.close()
         self._socket.close()
@@ -218,41 +560,107 @@ class AmuleClient:
 
         return ret
         
-    def _list_decoder(self, packet, ok_opcodes, item_tag, item_map):
+    def _get_plan(self, operation):
+        """Get the compiled decoder plan for operation
+        
+        Plans are compiled once per protocol version and operation and cached
+        on the client (see ecdecoder).
+        
+        """
+        
+        key = (self.protocol_version, operation)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = compile_plan(self.codes, operation)
+            self._plans[key] = plan
+        return plan
+        
+    def _list_decoder(self, packet, ok_opcodes, operation, records = False,
+                        deferred = False):
         """List packet decoder
         
         Decode packet into a dict() containing:
         - an 'ok' item as in _linear_decoder
         - a 'items' item which is in turn a dict().
         
-        'items' keys are values from the packet tags with tagname item_tag, and
-        each is filled like _linear_decoder does using item_map.
+        'items' keys are values from the packet item tags, and each is filled
+        according to the decoder plan for operation, either as a dict() or as
+        a record (see ecdecoder.ECRecord) when records is True.
+        
+        packet may be a _DeferredFrame, which is then handed to decode
+        workers.  When deferred is True, return an ECListResult instead of
+        waiting for workers, so that the caller can make other requests
+        meanwhile.
         
         """
-    
-        ret = {'ok': False}
-        if packet.opcode in ok_opcodes:
-            ret['ok'] = True
+        
+        plan = self._get_plan(operation)
+        if isinstance(packet, _DeferredFrame):
+            # Request information must be kept for hooks, as other requests
+            # may be made before the result is collected
+            info = self._request_info
+            self._request_info = None
             
-        items = dict()
-        for t in packet.tags:
-            if t.name == item_tag:
-                item = dict()
-                for st in t.subtags:
-                    if item_map.has_key(st.name):
-                        if isinstance(item_map[st.name], list):
-                            key, tagname = item_map[st.name]
-                            item[key] = []
-                            for sst in st.subtags:
-                                if sst.name == tagname:
-                                    item[key].append(sst.value)                                    
-                        else:
-                            item[item_map[st.name]] = st.value
-                items[t.value] = item
+            def finish(result):
+                compact, stats = result
+                ret = plan.expand_compact(compact, records)
+                if info is not None:
+                    self._request_done(stats['resp_opcode'], info,
+                        bytes_recv_raw = stats['bytes_recv_raw'],
+                        tags = stats['tags'],
+                        decompress_s = stats['decompress_s'],
+                        decode_s = stats['decode_s']
+                    )
+                    for hook in self._hooks:
+                        hook.on_decode(self, operation, stats['map_s'],
+                                        len(ret['items']))
+                return ret
                 
-        ret['items'] = items
+            result = ECListResult(self._decode_workers.submit(
+                        self.protocol_version, packet.flags, packet.data,
+                        operation, ok_opcodes, self._frame_limits), finish)
+            if deferred:
+                return result
+            return result.get()
+            
+        if deferred:
+            return ECListResult(value = self._list_decoder(packet, ok_opcodes,
+                                                        operation, records))
+            
+        if not self._hooks:
+            return plan.decode_list(packet, ok_opcodes, records)
+            
+        start = time.time()
+        ret = plan.decode_list(packet, ok_opcodes, records)
+        elapsed = time.time() - start
+        for hook in self._hooks:
+            hook.on_decode(self, operation, elapsed, len(ret['items']))
         return ret
      
+    def _update_view(self, view, fetch):
+        """Merge an incremental list update from fetch() into view
+
+        amuled keeps incremental update state per connection, so updates
+        requested outside of view (eg. get_download_list(update = True)) make
+        it miss fields.  When this is noticed, view is refreshed from a full
+        list instead.
+
+        """
+
+        try:
+            return view.apply(fetch(update = True))
+        except ECListDesyncError:
+            return view.apply(fetch())
+
+    def _list_items(self, packet, ok_opcodes, operation, records, deferred):
+        """Return list items as _list_decoder() does, or an ECListResult"""
+        if deferred:
+            return ECListResult(self._list_decoder(packet, ok_opcodes,
+                                    operation, records, True),
+                                lambda ret: ret['items'])
+        return self._list_decoder(packet, ok_opcodes, operation,
+                                    records)['items']
+    
     #
     # Status requests
     #
@@ -264,36 +672,8 @@ class AmuleClient:
         self._writepacket(req_packet)
         resp = self._readpacket()
         
-        mapping = {
-            self.codes.TAG_STATS_UL_SPEED: 'ul_speed',
-            self.codes.TAG_STATS_DL_SPEED: 'dl_speed',
-            self.codes.TAG_STATS_UL_SPEED_LIMIT: 'ul_speed_limit',
-            self.codes.TAG_STATS_DL_SPEED_LIMIT: 'dl_speed_limit',
-            self.codes.TAG_STATS_UL_QUEUE_LEN: 'ul_queue_len',
-            self.codes.TAG_STATS_TOTAL_SRC_COUNT: 'total_src_count',
-            self.codes.TAG_STATS_ED2K_USERS: 'ed2k_users',
-            self.codes.TAG_STATS_KAD_USERS: 'kad_users',
-            self.codes.TAG_STATS_ED2K_FILES: 'ed2k_files',
-            self.codes.TAG_STATS_KAD_FILES: 'kad_files',
-            self.codes.TAG_CONNSTATE: 'connstate'
-        }
-        
-        if self.protocol_version >= 0x0203:
-            sup = {
-                self.codes.TAG_STATS_KAD_FIREWALLED_UDP: 'kad_firewalled_udp',
-                self.codes.TAG_STATS_KAD_INDEXED_SOURCES: 'kad_indexed_sources',
-                self.codes.TAG_STATS_KAD_INDEXED_KEYWORDS: 'kad_indexed_keywords',
-                self.codes.TAG_STATS_KAD_INDEXED_NOTES: 'kad_indexed_notes',
-                self.codes.TAG_STATS_KAD_INDEXED_LOAD: 'kad_indexed_load',
-                self.codes.TAG_STATS_KAD_IP_ADRESS: 'kad_ip_address',
-                self.codes.TAG_STATS_BUDDY_STATUS: 'buddy_status',
-                self.codes.TAG_STATS_BUDDY_IP: 'buddy_ip',
-                self.codes.TAG_STATS_BUDDY_PORT: 'buddy_port'
-            }
-            for k in sup.keys():
-                mapping[k] = sup[k]
-        
-        ret = self._linear_decoder(resp, [self.codes.OP_STATS], mapping)
+        ret = self._get_plan('status').decode_linear(resp,
+                                                    [self.codes.OP_STATS])
         
         del(ret['ok'])
         
@@ -301,6 +681,367 @@ class AmuleClient:
             ret['client_id'] = resp.get_tag(self.codes.TAG_CONNSTATE).get_subtag(self.codes.TAG_CLIENT_ID).value
         return ret
 
+    def get_stats_tree(self, capping = None):
+        """Get the statistics tree from amuled
+        
+        When capping is not None, amuled limits the number of children shown
+        for some nodes (eg. client software versions) to capping.
+        
+        Return the root node as an ecstats.ECStatsNode, whose children are
+        only built when accessed, or None if amuled did not send a tree.  Use
+        ecstats.stats_tree_diff() to compare two trees.
+        
+        """
+        
+        from ecstats import ECStatsNode
+        
+        req_packet = ECPacket(self.codes, opcode = self.codes.OP_GET_STATSTREE)
+        if capping is not None:
+            req_packet.tags.append(ECUInt8Tag(capping,
+                                            self.codes.TAG_STATTREE_CAPPING))
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        if resp.opcode != self.codes.OP_STATSTREE:
+            return None
+        root = resp.get_tag(self.codes.TAG_STATTREE_NODE)
+        if root is None:
+            return None
+        return ECStatsNode(root, self.codes)
+    
+    #
+    # Server list
+    #
+    
+    def get_server_list(self, update = False, records = False,
+                        deferred = False):
+        """Get the server list from amuled
+        
+        Return a dict() with server addresses ('ip:port') as keys, each value
+        being a dict() with the following keys (when available): 'name',
+        'desc', 'address', 'ping', 'users', 'users_max', 'files', 'prio',
+        'failed', 'static', 'version'.
+        
+        update, records and deferred behave as in get_search_results().
+        
+        """
+        
+        req_packet = ECPacket(self.codes, opcode = self.codes.OP_GET_SERVER_LIST)
+        if update:
+            req_packet.tags.append(ECUInt8Tag(EC_DETAIL_INC_UPDATE,
+                                                self.codes.TAG_DETAIL_LEVEL))
+        self._writepacket(req_packet)
+        resp = self._readpacket(True)
+        
+        return self._list_items(resp, [self.codes.OP_SERVER_LIST], 'server',
+                                records, deferred)
+    
+    def update_server_view(self):
+        """Update the local server list view (self.servers)
+        
+        Return an (added, changed, removed) tuple as ECListView.apply() does.
+        
+        """
+        
+        return self._update_view(self.servers, self.get_server_list)
+    
+    def rank_servers(self):
+        """Rank servers from the local server list view
+        
+        Return a list of (address, item) tuples, best servers first, using
+        server_score().
+        
+        """
+        
+        ranked = [(server_score(item), address, item)
+                    for address, item in self.servers.items.iteritems()]
+        ranked.sort(reverse = True)
+        return [(address, item) for score, address, item in ranked]
+    
+    def server_connect(self, address):
+        """Connect amuled to server at address ('ip:port')"""
+        req_packet = ECPacket(self.codes, opcode = self.codes.OP_SERVER_CONNECT)
+        req_packet.tags.append(ECIPv4Tag(address, self.codes.TAG_SERVER))
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        if resp.opcode == self.codes.OP_NOOP:
+            return True
+        else:
+            return False
+    
+    def connect_best_server(self, attempts = 1):
+        """Connect amuled to the best ranked server
+        
+        Refresh the local server list view, then ask amuled to connect to
+        servers in rank order until it accepts, trying at most attempts
+        servers.
+        
+        Return the address of the server or None.
+        
+        """
+        
+        self.update_server_view()
+        for address, item in self.rank_servers()[:attempts]:
+            if self.server_connect(address):
+                return address
+        return None
+    
+    #
+    # Preferences
+    #
+    
+    def _fetch_prefs_sections(self, sections):
+        """Fetch preference sections tags from amuled into the cache"""
+        mask = 0
+        for section in sections:
+            mask = mask | PREFS_SECTIONS[section][0]
+        
+        req_packet = ECPacket(self.codes, opcode = self.codes.OP_GET_PREFERENCES)
+        req_packet.tags.append(ECUInt32Tag(mask, self.codes.TAG_SELECT_PREFS))
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        for section in sections:
+            tag = resp.get_tag(getattr(self.codes, PREFS_SECTIONS[section][1]))
+            if tag is None:
+                tag = ECCustomTag('', getattr(self.codes,
+                                                PREFS_SECTIONS[section][1]))
+            self._prefs_cache[section] = tag
+    
+    def get_preferences(self, sections = None, refresh = False):
+        """Get amuled preferences
+        
+        sections is a list of section names (see ecdecoder.PREFS_SECTIONS:
+        'connections', 'files', 'servers', 'security'...), or None to get all
+        sections.  Only requested sections are sent by amuled.  Sections are
+        cached and served from the cache unless refresh is True; the cache for
+        a section is invalidated when it is written with set_preferences().
+        
+        Return a dict() with section names as keys, each value being a dict()
+        of preferences as decoded by ecdecoder.decode_prefs().  Keys are tag
+        names without the 'TAG_' prefix, in lower case (eg. 'conn_max_dl').
+        
+        """
+        
+        if sections is None:
+            sections = PREFS_SECTIONS.keys()
+        for section in sections:
+            if not PREFS_SECTIONS.has_key(section):
+                raise ValueError("Unknown preference section: %s" % section)
+        
+        missing = [s for s in sections
+                    if refresh or not self._prefs_cache.has_key(s)]
+        if missing:
+            self._fetch_prefs_sections(missing)
+        
+        ret = {}
+        for section in sections:
+            ret[section] = decode_prefs(self.codes,
+                                        self._prefs_cache[section].subtags)
+        return ret
+    
+    def set_preferences(self, section, values):
+        """Change amuled preferences in a section
+        
+        values is a dict() with preference keys as returned by
+        get_preferences().  Only scalar preferences can be set; True and False
+        set or clear boolean preferences.
+        
+        amuled treats missing boolean preferences as cleared, so the whole
+        section is sent back, with current values for preferences that are not
+        in values.  The section cache is then invalidated.  ValueError is
+        raised for keys that are not preferences of section.
+        
+        Return True/False on success/failure.
+        
+        """
+        
+        if not self._prefs_cache.has_key(section):
+            self.get_preferences([section])
+        current = self._prefs_cache[section]
+        
+        values = values.copy()
+        tag = ECCustomTag('', current.name)
+        for st in current.subtags:
+            key = pref_key(self.codes, st.name)
+            if not values.has_key(key):
+                tag.subtags.append(st)
+                continue
+            
+            value = values.pop(key)
+            if value is False:
+                continue
+            elif value is True:
+                tag.subtags.append(ECCustomTag('', st.name))
+            else:
+                tag.subtags.append(st.__class__(value, st.name))
+        
+        for key, value in values.items():
+            # Preference tags are numbered after their section tag
+            name = getattr(self.codes, "TAG_" + key.upper(), None)
+            if name is None or name == current.name or \
+                    name & 0xFF00 != current.name & 0xFF00:
+                raise ValueError("Unknown preference in section %s: %s" %
+                                    (section, key))
+            if value is False:
+                continue
+            elif value is True:
+                tag.subtags.append(ECCustomTag('', name))
+            elif isinstance(value, basestring):
+                tag.subtags.append(ECStringTag(value, name))
+            else:
+                tag.subtags.append(ECUInt32Tag(value, name))
+        
+        req_packet = ECPacket(self.codes, opcode = self.codes.OP_SET_PREFERENCES)
+        req_packet.tags.append(tag)
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        del(self._prefs_cache[section])
+        
+        if resp.opcode == self.codes.OP_NOOP:
+            return True
+        else:
+            return False
+    
+    #
+    # Logs
+    #
+    
+    def _get_log_text(self, opcode):
+        req_packet = ECPacket(self.codes, opcode = opcode)
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        return "".join([t.value for t in resp.tags
+                            if t.name == self.codes.TAG_STRING])
+    
+    def _log_cmd(self, opcode):
+        req_packet = ECPacket(self.codes, opcode = opcode)
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        if resp.opcode == self.codes.OP_NOOP:
+            return True
+        else:
+            return False
+    
+    def get_log(self):
+        """Get amuled log text"""
+        return self._get_log_text(self.codes.OP_GET_LOG)
+    
+    def get_debug_log(self):
+        """Get amuled debug log text"""
+        return self._get_log_text(self.codes.OP_GET_DEBUGLOG)
+    
+    def get_server_info(self):
+        """Get amuled server info log text"""
+        return self._get_log_text(self.codes.OP_GET_SERVERINFO)
+    
+    def get_last_log_entry(self):
+        """Get the last line from amuled log"""
+        return self._get_log_text(self.codes.OP_GET_LAST_LOG_ENTRY)
+    
+    def reset_log(self):
+        """Clear amuled log"""
+        return self._log_cmd(self.codes.OP_RESET_LOG)
+    
+    def reset_debug_log(self):
+        """Clear amuled debug log"""
+        return self._log_cmd(self.codes.OP_RESET_DEBUGLOG)
+    
+    def clear_server_info(self):
+        """Clear amuled server info log"""
+        return self._log_cmd(self.codes.OP_CLEAR_SERVERINFO)
+    
+    def _log_lines(self, text, max_lines):
+        """Split the last max_lines lines of text
+        
+        Return a (lines, end) tuple, end being the position in text where the
+        last line ends.  Earlier lines are not split.
+        
+        """
+        
+        end = len(text)
+        if text.endswith("\n"):
+            end = end - 1
+        if end <= 0:
+            return ([], 0)
+        lines = text[:end].rsplit("\n", max_lines)
+        if len(lines) > max_lines:
+            del(lines[0])
+        return (lines, end)
+    
+    def _new_log_lines(self, source, text, max_lines):
+        """Return up to max_lines lines from text not seen in a previous call
+        
+        Logs only grow until they are reset, so the state for source is the
+        position where the last line seen ends and that line; only text after
+        it is split.  When text no longer matches them, the log is assumed to
+        have been reset and all lines are new.
+        
+        """
+        
+        end, last = self._log_state.get(source, (0, None))
+        start = 0
+        if last is not None and text[end - len(last):end] == last and \
+                (end == len(last) or text[end - len(last) - 1] == "\n") and \
+                text[end:end + 1] in ("", "\n"):
+            start = end + 1
+        
+        lines, end = self._log_lines(text[start:], max_lines)
+        if lines:
+            self._log_state[source] = (start + end, lines[-1])
+        elif not start:
+            self._log_state[source] = (0, None)
+        return lines
+    
+    def tail_log(self, debug = False, serverinfo = False, consume = False,
+                    max_lines = 1000):
+        """Generate log lines added since the last call
+        
+        Yield (source, line) tuples, source being 'log', 'debug' or
+        'serverinfo'.  The debug log and server info log are only followed
+        when debug and serverinfo are True.  At most max_lines lines are
+        generated for each source; older lines are dropped (and not even
+        split) when more are new.
+        
+        When consume is False, the last log entry is checked first and the full
+        log is only fetched when it changed; new lines are then found after the
+        last line seen in the previous call.  amuled has no request for part
+        of a log, so each poll where the log changed still transfers the whole
+        log.  When consume is True, logs are reset after being fetched so that
+        each call only transfers new lines.  Note that this clears logs for
+        all amuled clients, and that lines logged between the fetch and the
+        reset are lost.
+        
+        """
+        
+        sources = [('log', self.codes.OP_GET_LOG, self.codes.OP_RESET_LOG)]
+        if debug:
+            sources.append(('debug', self.codes.OP_GET_DEBUGLOG,
+                                self.codes.OP_RESET_DEBUGLOG))
+        if serverinfo:
+            sources.append(('serverinfo', self.codes.OP_GET_SERVERINFO,
+                                self.codes.OP_CLEAR_SERVERINFO))
+        
+        for source, get_opcode, reset_opcode in sources:
+            if consume:
+                lines = self._log_lines(self._get_log_text(get_opcode),
+                                        max_lines)[0]
+                self._log_cmd(reset_opcode)
+            else:
+                if source == 'log' and self._log_state.has_key(source):
+                    last = self.get_last_log_entry().rstrip("\r\n")
+                    if last == self._log_state[source][1]:
+                        continue
+                lines = self._new_log_lines(source,
+                                self._get_log_text(get_opcode), max_lines)
+            
+            for line in lines:
+                yield (source, line)
+    
     #
     # Search requests
     #
@@ -319,7 +1060,7 @@ class AmuleClient:
         ext:     file extension or None
         
         Return a dict() with two keys:
-        - 'ok': True or False
+        - 'ok': True when the search started, False when amuled rejected it
         - 'message': reason for 'ok', as told by amuled
         
         """
@@ -341,11 +1082,28 @@ class AmuleClient:
         self._writepacket(req_packet)
         resp = self._readpacket()
         
-        return self._linear_decoder(resp,
+        ret = self._linear_decoder(resp,
             [self.codes.OP_FAILED],
             {self.codes.TAG_STRING: 'message'}
         )
         
+        # amuled answers OP_FAILED whether the search started or not, only the
+        # message tells
+        if ret['ok']:
+            ret['ok'] = (ret.get('message') or '').startswith(SEARCH_STARTED)
+        return ret
+        
+    def search_stop(self):
+        """Stop the current search"""
+        req_packet = ECPacket(self.codes, opcode = self.codes.OP_SEARCH_STOP)
+        self._writepacket(req_packet)
+        resp = self._readpacket()
+        
+        if resp.opcode == self.codes.OP_NOOP:
+            return True
+        else:
+            return False
+        
     def get_search_progress(self):
         """Get search progress from amuled
         
@@ -360,7 +1118,8 @@ class AmuleClient:
         
         return resp.get_tag(self.codes.TAG_SEARCH_STATUS).value
         
-    def get_search_results(self, update = False):
+    def get_search_results(self, update = False, records = False,
+                            deferred = False):
         """Get search results from amuled
         
         Return a dict() with hashes as keys, each value being a dict() with the
@@ -373,7 +1132,17 @@ class AmuleClient:
         When update is True, only new results are filled, and changed results
         (eg. additional seeds found) only have changed keys filled.  All result
         hashes are present, though.  'new' and 'changed' refer to the last time
-        search results were fetched from amuled.
+        search results were fetched from amuled.  This state is kept by amuled
+        for the whole connection and shared with the list views (see
+        update_download_view()), which refetch full lists when they notice
+        updates they did not see.
+        
+        When records is True, values are records with one attribute per key
+        instead of dicts, unfilled attributes being None.
+        
+        When deferred is True, return an ECListResult instead of the dict().
+        Large responses may then still be being decoded by decode workers (see
+        set_decode_workers()) while other requests are made.
         
         """
         req_packet = ECPacket(self.codes, opcode = self.codes.OP_SEARCH_RESULTS)
@@ -381,60 +1150,175 @@ class AmuleClient:
             req_packet.tags.append(ECUInt8Tag(EC_DETAIL_INC_UPDATE,
                                                 self.codes.TAG_DETAIL_LEVEL))
         self._writepacket(req_packet)
-        resp = self._readpacket()
+        resp = self._readpacket(True)
         
-        return self._list_decoder(resp,
-            [self.codes.OP_SEARCH_RESULTS],
-            self.codes.TAG_SEARCHFILE,
-            {
-                self.codes.TAG_PARTFILE_SOURCE_COUNT: 'src_count',
-                self.codes.TAG_PARTFILE_SOURCE_COUNT_XFER: 'src_count_xfer',
-                self.codes.TAG_PARTFILE_NAME: 'name',
-                self.codes.TAG_PARTFILE_SIZE_FULL: 'size'
-            }
-        )['items']
+        return self._list_items(resp, [self.codes.OP_SEARCH_RESULTS], 'search',
+                                records, deferred)
         
     #
     # Shared list
     #    
         
-    def get_shared_list(self, update = False):
+    def get_shared_list(self, update = False, records = False,
+                        deferred = False):
         req_packet = ECPacket(self.codes, opcode = self.codes.OP_GET_SHARED_FILES)
         if update:
             req_packet.tags.append(ECUInt8Tag(EC_DETAIL_INC_UPDATE,
                                                 self.codes.TAG_DETAIL_LEVEL))
         self._writepacket(req_packet)
-        resp = self._readpacket()
+        resp = self._readpacket(True)
 
-        mapping = {
-            self.codes.TAG_PARTFILE_NAME: 'name',
-            self.codes.TAG_PARTFILE_SIZE_FULL: 'size',
-            self.codes.TAG_PARTFILE_ED2K_LINK: 'ed2k_link',
-            self.codes.TAG_PARTFILE_PRIO: 'prio',
-            self.codes.TAG_KNOWNFILE_XFERRED: 'xferred',
-            self.codes.TAG_KNOWNFILE_XFERRED_ALL: 'xferred_all',
-            self.codes.TAG_KNOWNFILE_REQ_COUNT: 'req_count',
-            self.codes.TAG_KNOWNFILE_REQ_COUNT_ALL: 'req_count_all',
-            self.codes.TAG_KNOWNFILE_ACCEPT_COUNT: 'accept_count',
-            self.codes.TAG_KNOWNFILE_ACCEPT_COUNT_ALL: 'accept_count_all',
-            self.codes.TAG_KNOWNFILE_AICH_MASTERHASH: 'aich_masterhash'
-        }
+        return self._list_items(resp, [self.codes.OP_SHARED_FILES], 'shared',
+                                records, deferred)
         
-        return self._list_decoder(resp,
-            [self.codes.OP_SHARED_FILES],
-            self.codes.TAG_KNOWNFILE,
-            mapping
-        )['items']
+    def update_shared_view(self):
+        """Update the local shared list view
+
+        Fetch an incremental shared list update from amuled and merge it into
+        self.shared (an ECListView).  Return an (added, changed, removed) tuple
+        as ECListView.apply() does.
+
+        """
+
+        return self._update_view(self.shared, self.get_shared_list)
+
+    def reload_shared_files(self, wait = False, settle = None, **kwargs):
+        """Make amuled reload shared files
+        
+        When wait is True, the shared view is refreshed before the reload
+        request and wait_for_reload() is called afterwards with settle (which
+        is then required) and kwargs (timeout, interval); True is then only
+        returned if reloading completed before timeout.  Call
+        wait_for_reload() directly to get added and removed files.
         
-    def reload_shared_files(self):
+        """
+        
+        if wait:
+            if settle is None:
+                raise ValueError("settle is required when waiting for reload")
+            self.update_shared_view()
+            
         req_packet = ECPacket(self.codes, opcode = self.codes.OP_SHAREDFILES_RELOAD)
         self._writepacket(req_packet)
         resp = self._readpacket()
         
-        if resp.opcode == self.codes.OP_NOOP:
-            return True
-        else:
+        if resp.opcode != self.codes.OP_NOOP:
             return False
+        if wait:
+            return self.wait_for_reload(settle, **kwargs)[0]
+        return True
+        
+    def wait_for_reload(self, settle, timeout = 300, interval = 2.0):
+        """Wait until amuled is done (re)loading shared files
+        
+        Poll incremental shared list updates (see update_shared_view()) every
+        interval seconds, and consider loading complete once no shared file
+        was added or removed for settle seconds.  Files being hashed only show
+        up once hashed, so settle must exceed the time needed to hash the
+        largest expected file (amuled hashes at disk speed, so allow at least
+        file size / disk read rate).  Only the files that changed are
+        transferred at each poll.
+        
+        Changes are relative to the shared view (self.shared), which should be
+        up to date before the reload or addition of directories; it is
+        fetched first if it was never updated.
+        
+        Return an (complete, added, removed) tuple, complete being False when
+        timeout seconds elapsed first, and added and removed lists of hashes
+        of shared files added and removed while waiting.
+        
+        """
+        
+        if self.shared.updated is None:
+            self.update_shared_view()
+            
+        start = time.time()
+        last_change = start
+        added = {}
+        removed = {}
+        while 1:
+            a, c, r = self.update_shared_view()
+            now = time.time()
+            for h in a:
+                if removed.has_key(h):
+                    del(removed[h])
+                else:
+                    added[h] = True
+            for h in r:
+                if added.has_key(h):
+                    del(added[h])
+                else:
+                    removed[h] = True
+            if a or r:
+                last_change = now
+                
+            if now - last_change >= settle:
+                return (True, added.keys(), removed.keys())
+            if now - start >= timeout:
+                return (False, added.keys(), removed.keys())
+            time.sleep(interval)
+            
+    def add_shared_directories(self, directories, max_tags = 500,
+                                max_bytes = 65536):
+        """Add directories to the shared directories
+        
+        Directories are sent in chunks of at most max_tags directories and
+        max_bytes bytes of tag data.  amuled then hashes new files in the
+        background; use wait_for_reload() to wait until they are shared.  The
+        shared view is fetched first if it was never updated, so that shared
+        files are not mistaken for new ones.
+        
+        Return a dict() with directories as keys and True/False as values.
+        
+        """
+        
+        if self.shared.updated is None:
+            self.update_shared_view()
+            
+        tags = [ECStringTag(d, self.codes.TAG_PREFS_DIRECTORIES)
+                    for d in directories]
+        ret = {}
+        for chunk in _split_tags(tags, max_tags, max_bytes):
+            req_packet = ECPacket(self.codes,
+                                opcode = self.codes.OP_SHAREDFILES_ADD_DIRECTORY)
+            req_packet.tags.extend(chunk)
+            self._writepacket(req_packet)
+            resp = self._readpacket()
+            
+            ok = resp.opcode == self.codes.OP_NOOP
+            for tag in chunk:
+                ret[tag.value] = ok
+        return ret
+        
+    def shared_set_prio(self, hashes, prio, max_tags = 500,
+                        max_bytes = 32768):
+        """Set the upload priority of many shared files
+        
+        hashes are sent in chunks of at most max_tags files and max_bytes bytes
+        of tag data.
+        
+        Return a dict() with hashes as keys and True/False as values.
+        
+        """
+        
+        tags = []
+        for h in hashes:
+            tag = ECHash16Tag(h, self.codes.TAG_KNOWNFILE)
+            tag.subtags.append(ECUInt8Tag(prio, self.codes.TAG_PARTFILE_PRIO))
+            tags.append(tag)
+            
+        ret = {}
+        for chunk in _split_tags(tags, max_tags, max_bytes):
+            req_packet = ECPacket(self.codes,
+                                opcode = self.codes.OP_SHARED_SET_PRIO)
+            req_packet.tags.extend(chunk)
+            self._writepacket(req_packet)
+            resp = self._readpacket()
+            
+            ok = resp.opcode == self.codes.OP_NOOP
+            for tag in chunk:
+                ret[tag.value] = ok
+        return ret
      
     #
     # Download list
@@ -467,7 +1351,69 @@ class AmuleClient:
         else:
             return False
         
-    def get_download_list(self, detail = False, update = False):
+    def download_ed2klinks_bulk(self, links, category = 0, skip_known = True,
+                                max_tags = 500, max_bytes = 65536):
+        """Add many ed2k links to the download queue
+        
+        Links are parsed locally (see ed2k.parse_ed2k_link()); invalid links
+        and links whose hash was already seen in links are dropped.  When
+        skip_known is True, the download and shared views are refreshed (see
+        update_download_view() and update_shared_view()) and links to files
+        that are already downloading or shared are dropped too.
+        
+        Remaining links are sent in chunks of at most max_tags links and
+        max_bytes bytes of tag data.
+        
+        Return a dict() with links as keys and one of the following statuses
+        as values: 'invalid', 'duplicate', 'downloading', 'shared', 'added' or
+        'failed'.
+        
+        """
+        
+        from ed2k import parse_ed2k_link
+        
+        if skip_known:
+            self.update_download_view()
+            self.update_shared_view()
+        
+        ret = {}
+        seen = {}
+        tags = []
+        for l in links:
+            if ret.has_key(l):
+                continue
+            parsed = parse_ed2k_link(l)
+            if parsed is None:
+                ret[l] = 'invalid'
+            elif seen.has_key(parsed[2]):
+                ret[l] = 'duplicate'
+            elif skip_known and parsed[2] in self.downloads:
+                ret[l] = 'downloading'
+            elif skip_known and parsed[2] in self.shared:
+                ret[l] = 'shared'
+            else:
+                seen[parsed[2]] = True
+                tag = ECStringTag(l, self.codes.TAG_STRING)
+                tag.subtags.append(ECUInt8Tag(category, self.codes.TAG_CATEGORY))
+                tags.append(tag)
+        
+        for chunk in _split_tags(tags, max_tags, max_bytes):
+            req_packet = ECPacket(self.codes, opcode = self.codes.OP_ADD_LINK)
+            req_packet.tags.extend(chunk)
+            self._writepacket(req_packet)
+            resp = self._readpacket()
+            
+            if resp.opcode == self.codes.OP_NOOP:
+                status = 'added'
+            else:
+                status = 'failed'
+            for tag in chunk:
+                ret[tag.value] = status
+        
+        return ret
+        
+    def get_download_list(self, detail = False, update = False,
+                            records = False, deferred = False):
         if detail:
             req_packet = ECPacket(self.codes, opcode = self.codes.OP_GET_DLOAD_QUEUE_DETAIL)
             req_packet.tags.append(ECUInt8Tag(EC_DETAIL_FULL,
@@ -478,45 +1424,186 @@ class AmuleClient:
                 req_packet.tags.append(ECUInt8Tag(EC_DETAIL_INC_UPDATE,
                                                     self.codes.TAG_DETAIL_LEVEL))
         self._writepacket(req_packet)
-        resp = self._readpacket()
+        resp = self._readpacket(True)
 
-        mapping = {
-            self.codes.TAG_PARTFILE_STATUS: 'status',
-            self.codes.TAG_PARTFILE_SOURCE_COUNT: 'src_count',
-            self.codes.TAG_PARTFILE_SOURCE_COUNT_NOT_CURRENT: 'src_count_not_current',
-            self.codes.TAG_PARTFILE_SOURCE_COUNT_XFER: 'src_count_xfer',
-            self.codes.TAG_PARTFILE_SOURCE_COUNT_A4AF: 'src_count_a4af',
-            self.codes.TAG_PARTFILE_NAME: 'name',
-            self.codes.TAG_PARTFILE_SIZE_XFER: 'size_xfer',
-            self.codes.TAG_PARTFILE_SIZE_DONE: 'size_done',
-            self.codes.TAG_PARTFILE_SIZE_FULL: 'size',
-            self.codes.TAG_PARTFILE_SPEED: 'speed',
-            self.codes.TAG_PARTFILE_PRIO: 'prio',
-            self.codes.TAG_PARTFILE_CAT: 'cat',
-            self.codes.TAG_PARTFILE_LAST_SEEN_COMP: 'last_seen_comp',
-            self.codes.TAG_PARTFILE_LAST_RECV: 'last_recv',
-            self.codes.TAG_PARTFILE_PARTMETID: 'partmetid',
-            self.codes.TAG_PARTFILE_ED2K_LINK: 'ed2k_link',
-            self.codes.TAG_PARTFILE_SOURCE_NAMES: ['source_names', self.codes.TAG_PARTFILE_SOURCE_NAMES]
-        }
+        return self._list_items(resp, [self.codes.OP_DLOAD_QUEUE], 'download',
+                                records, deferred)
         
-        if self.protocol_version >= 0x0203:
-            sup = {
-                self.codes.TAG_PARTFILE_LOST_CORRUPTION: 'lost_corruption',
-                self.codes.TAG_PARTFILE_GAINED_COMPRESSION: 'gained_compression',
-                self.codes.TAG_PARTFILE_SAVED_ICH: 'saved_ich',
-                self.codes.TAG_PARTFILE_STOPPED: 'stopped',
-                self.codes.TAG_PARTFILE_DOWNLOAD_ACTIVE: 'download_active'
-            }
-            for k in sup.keys():
-                mapping[k] = sup[k]
-        
-        return self._list_decoder(resp,
-            [self.codes.OP_DLOAD_QUEUE],
-            self.codes.TAG_PARTFILE,
-            mapping
-        )['items']
+    def update_download_view(self):
+        """Update the local download list view
+
+        Fetch an incremental download list update from amuled and merge it
+        into self.downloads (an ECListView).  Return an (added, changed,
+        removed) tuple as ECListView.apply() does.  Cached details of changed
+        and removed partfiles are dropped (see get_partfile_details()).
+
+        """
+
+        added, changed, removed = self._update_view(self.downloads,
+                                                    self.get_download_list)
+        for h in changed:
+            self.details_cache.discard(h)
+        for h in removed:
+            self.details_cache.discard(h)
+        return (added, changed, removed)
+
+    def get_partfile_details(self, hashes, refresh = False):
+        """Get detailed information for some partfiles
+        
+        Only request details (as get_download_list(detail = True) does) for
+        partfiles with given hashes.  Results are kept in self.details_cache
+        (an ECLRUCache) and served from there on subsequent calls unless
+        refresh is True, until they expire or update_download_view() sees the
+        partfile change.
+        
+        Return a dict() with hashes as keys and dicts as values, as
+        get_download_list() does.  Unknown hashes are not present.  Values
+        are copies that callers may modify.
+        
+        """
+        
+        ret = {}
+        missing = []
+        for h in hashes:
+            item = None
+            if not refresh:
+                item = self.details_cache.get(h)
+            if item is None:
+                missing.append(h)
+            else:
+                ret[h] = copy.deepcopy(item)
+        
+        if missing:
+            req_packet = ECPacket(self.codes,
+                                opcode = self.codes.OP_GET_DLOAD_QUEUE_DETAIL)
+            req_packet.tags.append(ECUInt8Tag(EC_DETAIL_FULL,
+                                                self.codes.TAG_DETAIL_LEVEL))
+            for h in missing:
+                req_packet.tags.append(ECHash16Tag(h, self.codes.TAG_PARTFILE))
+            self._writepacket(req_packet)
+            resp = self._readpacket(True)
+            
+            items = self._list_decoder(resp,
+                [self.codes.OP_DLOAD_QUEUE],
+                'download'
+            )['items']
+            
+            for h in missing:
+                if items.has_key(h):
+                    self.details_cache.put(h, items[h])
+                    ret[h] = copy.deepcopy(items[h])
         
+        return ret
+
+    #
+    # Upload and wait queues
+    #
+    
+    def _get_client_queue(self, opcode, ok_opcode, update, records,
+                            deferred):
+        req_packet = ECPacket(self.codes, opcode = opcode)
+        if update:
+            req_packet.tags.append(ECUInt8Tag(EC_DETAIL_INC_UPDATE,
+                                                self.codes.TAG_DETAIL_LEVEL))
+        self._writepacket(req_packet)
+        resp = self._readpacket(True)
+        
+        return self._list_items(resp, [ok_opcode], 'client', records, deferred)
+    
+    def get_upload_queue(self, update = False, records = False,
+                            deferred = False):
+        """Get the upload queue from amuled
+        
+        Return a dict() with client IDs as keys, each value being a dict() with
+        the following keys (when available):
+        - 'name', 'software', 'software_version': client name and software
+        - 'up_speed', 'down_speed': transfer speeds
+        - 'upload_session', 'upload_total', 'download_total': transferred bytes
+        - 'file_hash', 'file_name': file being transferred
+        - 'state', 'score', 'waiting_position', 'user_ip', 'user_port'
+        - 'obfuscated', 'remote_queue_rank', 'asked_count' (protocol 0x0203)
+        
+        update, records and deferred behave as in get_search_results().
+        
+        """
+        
+        return self._get_client_queue(self.codes.OP_GET_ULOAD_QUEUE,
+                            self.codes.OP_ULOAD_QUEUE, update, records, deferred)
+    
+    def get_wait_queue(self, update = False, records = False,
+                        deferred = False):
+        """Get the wait queue from amuled
+        
+        Return a dict() like get_upload_queue() does.
+        
+        """
+        
+        return self._get_client_queue(self.codes.OP_GET_WAIT_QUEUE,
+                            self.codes.OP_WAIT_QUEUE, update, records, deferred)
+    
+    def update_upload_view(self):
+        """Update the local upload queue view (self.uploads)
+        
+        Return an (added, changed, removed) tuple as ECListView.apply() does.
+        
+        """
+        
+        return self._update_view(self.uploads, self.get_upload_queue)
+    
+    def update_wait_view(self):
+        """Update the local wait queue view (self.waiting)
+        
+        Return an (added, changed, removed) tuple as ECListView.apply() does.
+        
+        """
+        
+        return self._update_view(self.waiting, self.get_wait_queue)
+
+    #
+    # Snapshots
+    #
+
+    def save_snapshot(self, path, identity):
+        """Save local list views to a snapshot file
+
+        identity is a caller-defined string identifying the daemon (eg.
+        'host:port').  The snapshot is also keyed by the server version of the
+        current connection.
+
+        """
+
+        from snapshot import save_snapshot
+
+        save_snapshot(path, identity, self.server_version, {
+            'downloads': self.downloads.items,
+            'shared': self.shared.items
+        })
+
+    def load_snapshot(self, path, identity):
+        """Load local list views from a snapshot file
+
+        The snapshot is only used when identity matches and, when connected,
+        when its server version matches the one of the current connection.
+        Further update_download_view() and update_shared_view() calls then
+        merge incremental updates into the loaded views.
+
+        Note that amuled tracks incremental update state per connection, so the
+        first update on a new connection may still carry full item data.
+
+        Return True if the snapshot was loaded, False if not.
+
+        """
+
+        from snapshot import load_snapshot
+
+        lists = load_snapshot(path, identity, self.server_version)
+        if lists is None:
+            return False
+
+        self.downloads = ECListView(lists.get('downloads', {}))
+        self.shared = ECListView(lists.get('shared', {}))
+        return True
+
     #
     # Downloading files handling
     #
@@ -600,3 +1687,180 @@ class AmuleClient:
         arg = ECUInt8Tag(cat, self.codes.TAG_PARTFILE_CAT)
         return self._partfile_cmd(hashes, self.codes.OP_PARTFILE_SET_CAT, arg)
         
+    #
+    # Bulk partfile commands
+    #
+    
+    def _partfile_verifier(self, opcode, arg):
+        """Return a function checking the outcome of a partfile command
+        
+        The function is called with the partfile item from the download view
+        (or None if it is not there) and returns True/False.  Return None when
+        the command outcome cannot be checked from the download list.
+        
+        """
+        
+        codes = self.codes
+        
+        if opcode == codes.OP_PARTFILE_DELETE:
+            return lambda item: item is None
+        elif opcode == codes.OP_PARTFILE_PAUSE:
+            return lambda item: item is not None and \
+                        item.get('status') == EC_PS_PAUSED
+        elif opcode == codes.OP_PARTFILE_RESUME:
+            return lambda item: item is not None and \
+                        item.get('status') != EC_PS_PAUSED and \
+                        not item.get('stopped')
+        elif opcode == codes.OP_PARTFILE_STOP:
+            return lambda item: item is not None and \
+                        (item.get('stopped') or
+                         item.get('status') == EC_PS_PAUSED)
+        elif opcode == codes.OP_PARTFILE_PRIO_SET:
+            if arg.value == EC_PR_AUTO:
+                # amuled reports automatic priorities with a +10 offset
+                return lambda item: item is not None and \
+                            item.get('prio', 0) >= 10
+            return lambda item: item is not None and \
+                        item.get('prio') == arg.value
+        elif opcode == codes.OP_PARTFILE_SET_CAT:
+            return lambda item: item is not None and \
+                        item.get('cat') == arg.value
+        return None
+    
+    def partfile_bulk_cmd(self, hashes, opcode, arg = None, pool = None,
+                            max_tags = 500, max_bytes = 32768):
+        """Send a partfile command for many partfiles
+        
+        hashes are split into chunks of at most max_tags partfiles and
+        max_bytes bytes of tag data, each sent as a separate command.  When
+        pool is an AmuleClientPool to the same amuled, chunks are sent in
+        parallel using clients from the pool; otherwise they are sent in
+        sequence on this client.
+        
+        The outcome is then checked for each partfile against an incremental
+        update of the download view (see update_download_view()), when the
+        command allows it.
+        
+        Return a dict() with hashes as keys and True/False as values.  When
+        sending some chunks raised an exception (other than amuled refusing
+        the command), the remaining chunks are still sent, and ECBulkError is
+        then raised with the unverified results and the exception for each
+        partfile of failed chunks.
+        
+        """
+        
+        tags = []
+        for h in hashes:
+            tag = ECHash16Tag(h, self.codes.TAG_PARTFILE)
+            if arg is not None:
+                tag.subtags.append(arg)
+            tags.append(tag)
+        chunks = _split_tags(tags, max_tags, max_bytes)
+        acks = [False] * len(chunks)
+        errors = [None] * len(chunks)
+        
+        def send_chunk(client, index):
+            req_packet = ECPacket(client.codes, opcode = opcode)
+            req_packet.tags.extend(chunks[index])
+            try:
+                client._writepacket(req_packet)
+                resp = client._readpacket()
+            except Exception, e:
+                errors[index] = e
+                return False
+            acks[index] = resp.opcode == client.codes.OP_NOOP
+            return True
+        
+        if pool is None or len(chunks) < 2:
+            for i in range(len(chunks)):
+                send_chunk(self, i)
+        else:
+            import threading
+            
+            pending = range(len(chunks))
+            lock = threading.Lock()
+            
+            # Workers that cannot get a client put their chunk back and stop;
+            # chunks left over are then sent on this client
+            def worker():
+                while 1:
+                    lock.acquire()
+                    try:
+                        if not pending:
+                            return
+                        index = pending.pop()
+                    finally:
+                        lock.release()
+                    try:
+                        client = pool.acquire()
+                    except Exception:
+                        lock.acquire()
+                        try:
+                            pending.append(index)
+                        finally:
+                            lock.release()
+                        return
+                    if send_chunk(client, index):
+                        pool.release(client)
+                    else:
+                        pool.release(client, True)
+            
+            workers = []
+            for i in range(min(pool.size, len(chunks))):
+                t = threading.Thread(target = worker)
+                t.start()
+                workers.append(t)
+            for t in workers:
+                t.join()
+            for i in pending:
+                send_chunk(self, i)
+        
+        ret = {}
+        failed = {}
+        for i in range(len(chunks)):
+            for tag in chunks[i]:
+                ret[tag.value] = acks[i]
+                if errors[i] is not None:
+                    failed[tag.value] = errors[i]
+        if failed:
+            raise ECBulkError(ret, failed)
+        
+        verify = self._partfile_verifier(opcode, arg)
+        if verify is not None:
+            self.update_download_view()
+            for h in ret.keys():
+                ret[h] = ret[h] and bool(verify(self.downloads.get(h)))
+        
+        return ret
+        
+    def partfile_pause_bulk(self, hashes, **kwargs):
+        """Pause many partfiles, see partfile_bulk_cmd()"""
+        return self.partfile_bulk_cmd(hashes, self.codes.OP_PARTFILE_PAUSE,
+                                        **kwargs)
+        
+    def partfile_resume_bulk(self, hashes, **kwargs):
+        """Resume many partfiles, see partfile_bulk_cmd()"""
+        return self.partfile_bulk_cmd(hashes, self.codes.OP_PARTFILE_RESUME,
+                                        **kwargs)
+        
+    def partfile_stop_bulk(self, hashes, **kwargs):
+        """Stop many partfiles, see partfile_bulk_cmd()"""
+        return self.partfile_bulk_cmd(hashes, self.codes.OP_PARTFILE_STOP,
+                                        **kwargs)
+        
+    def partfile_delete_bulk(self, hashes, **kwargs):
+        """Delete many partfiles, see partfile_bulk_cmd()"""
+        return self.partfile_bulk_cmd(hashes, self.codes.OP_PARTFILE_DELETE,
+                                        **kwargs)
+        
+    def partfile_set_prio_bulk(self, hashes, prio, **kwargs):
+        """Set priority of many partfiles, see partfile_bulk_cmd()"""
+        arg = ECUInt8Tag(prio, self.codes.TAG_PARTFILE_PRIO)
+        return self.partfile_bulk_cmd(hashes, self.codes.OP_PARTFILE_PRIO_SET,
+                                        arg, **kwargs)
+        
+    def partfile_set_cat_bulk(self, hashes, cat = 0, **kwargs):
+        """Set category of many partfiles, see partfile_bulk_cmd()"""
+        arg = ECUInt8Tag(cat, self.codes.TAG_PARTFILE_CAT)
+        return self.partfile_bulk_cmd(hashes, self.codes.OP_PARTFILE_SET_CAT,
+                                        arg, **kwargs)
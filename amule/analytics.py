@@ -0,0 +1,286 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Transfer analytics
+
+TransferAnalytics follows download progress from successive download lists
+and keeps, for each partfile, an exponentially weighted moving average (EWMA)
+of its download speed computed from size_done progress, the time of its last
+progress (for stall detection) and an ETA estimate.  Fleet-wide aggregates
+are kept as well.
+
+Per-partfile state lives in compact arrays.  Speeds decay with time: a
+partfile that does not change between updates (as with incremental updates)
+simply sees its speed decay, which is computed when it is read.  Speeds are
+stored scaled to a common reference time so that their sum decays the same
+way, which keeps updates O(changed partfiles):
+
+    analytics = TransferAnalytics()
+    while 1:
+        changes = client.update_download_view()
+        analytics.apply(client.downloads, changes)
+        print analytics.fleet()
+
+"""
+
+import time
+from array import array
+
+from eccodes import EC_PS_PAUSED, EC_PS_COMPLETING, EC_PS_COMPLETE
+
+
+# Rebase scaled speeds when the scale factor exceeds 2 ** _MAX_EXPONENT
+_MAX_EXPONENT = 500.0
+
+# Partfile statuses that are not expected to make progress
+_INACTIVE = (EC_PS_PAUSED, EC_PS_COMPLETING, EC_PS_COMPLETE)
+
+
+class TransferAnalytics:
+    """Smoothed download speeds, stall detection and ETAs
+
+    half_life is the EWMA half-life in seconds: progress made half_life
+    seconds ago weighs half as much as current progress.  Partfiles that made
+    no progress for stall_after seconds (and are neither paused nor complete)
+    are considered stalled.
+
+    """
+
+    def __init__(self, half_life = 30.0, stall_after = 300.0):
+        self.half_life = float(half_life)
+        self.stall_after = stall_after
+        self.clear()
+
+    def clear(self):
+        """Forget all partfiles"""
+        self._index = {}
+        self._free = []
+        self._time = array('d')
+        self._done = array('d')
+        self._size = array('d')
+        self._scaled = array('d')
+        self._progress = array('d')
+        self._status = array('i')
+        self._ref = None
+        self._scaled_sum = 0.0
+        self._total_size = 0.0
+        self._total_done = 0.0
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return self._index.has_key(key)
+
+    def _scale(self, now):
+        if self._ref is None:
+            self._ref = now
+        exponent = (now - self._ref) / self.half_life
+        if exponent > _MAX_EXPONENT:
+            self._rebase(now)
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def _rebase(self, now):
+        factor = 2.0 ** ((now - self._ref) / self.half_life)
+        scaled = self._scaled
+        total = 0.0
+        for i in self._index.itervalues():
+            scaled[i] = scaled[i] / factor
+            total = total + scaled[i]
+        self._scaled_sum = total
+        self._ref = now
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        for column in (self._time, self._done, self._size, self._scaled,
+                        self._progress):
+            column.append(0.0)
+        self._status.append(0)
+        return len(self._time) - 1
+
+    def _update(self, key, fields, now, scale):
+        i = self._index.get(key)
+        done = fields.get('size_done')
+        size = fields.get('size')
+        status = fields.get('status')
+
+        if i is None:
+            i = self._allocate()
+            self._index[key] = i
+            self._time[i] = now
+            self._progress[i] = now
+            self._done[i] = float(done or 0)
+            self._size[i] = float(size or 0)
+            self._status[i] = status or 0
+            self._scaled[i] = float(fields.get('speed') or 0) * scale
+            self._scaled_sum = self._scaled_sum + self._scaled[i]
+            self._total_done = self._total_done + self._done[i]
+            self._total_size = self._total_size + self._size[i]
+            return
+
+        if status is not None:
+            self._status[i] = status
+        if size is not None:
+            self._total_size = self._total_size + size - self._size[i]
+            self._size[i] = float(size)
+
+        elapsed = now - self._time[i]
+        if elapsed <= 0:
+            return
+
+        old_done = self._done[i]
+        if done is None:
+            done = old_done
+        progress = max(done - old_done, 0)
+
+        # Decayed speed is (1 - alpha) * old speed; add alpha * new speed
+        alpha = 1.0 - 0.5 ** (elapsed / self.half_life)
+        scaled = self._scaled[i] + alpha * progress / elapsed * scale
+        self._scaled_sum = self._scaled_sum + scaled - self._scaled[i]
+        self._scaled[i] = scaled
+        self._time[i] = now
+        if progress:
+            self._progress[i] = now
+        self._total_done = self._total_done + done - old_done
+        self._done[i] = float(done)
+
+    def _remove(self, key):
+        i = self._index.pop(key, None)
+        if i is None:
+            return
+        self._scaled_sum = self._scaled_sum - self._scaled[i]
+        self._total_done = self._total_done - self._done[i]
+        self._total_size = self._total_size - self._size[i]
+        self._scaled[i] = 0.0
+        self._free.append(i)
+
+    def apply(self, items, changes, now = None):
+        """Account for an incremental update
+
+        items is a dict() or ECListView of partfile fields keyed by hash and
+        changes an (added, changed, removed) tuple of hash lists, as returned
+        by AmuleClient.update_download_view().  Only listed partfiles are
+        visited.
+
+        """
+
+        if now is None:
+            now = time.time()
+        scale = self._scale(now)
+        added, changed, removed = changes
+        for key in added:
+            self._update(key, items[key], now, scale)
+        for key in changed:
+            self._update(key, items[key], now, scale)
+        for key in removed:
+            self._remove(key)
+
+    def snapshot(self, items, now = None):
+        """Account for a full download list (dict() keyed by hash)"""
+        if now is None:
+            now = time.time()
+        scale = self._scale(now)
+        for key, fields in items.iteritems():
+            self._update(key, fields, now, scale)
+        for key in [k for k in self._index if not items.has_key(k)]:
+            self._remove(key)
+
+    def speed(self, key, now = None):
+        """Return the smoothed speed of a partfile in bytes/second"""
+        if now is None:
+            now = time.time()
+        return self._scaled[self._index[key]] / self._scale(now)
+
+    def stalled(self, key, now = None):
+        """Return True if a partfile stalled"""
+        if now is None:
+            now = time.time()
+        i = self._index[key]
+        return self._is_stalled(i, now)
+
+    def _is_stalled(self, i, now):
+        return self._status[i] not in _INACTIVE and \
+                self._done[i] < self._size[i] and \
+                now - self._progress[i] > self.stall_after
+
+    def eta(self, key, now = None):
+        """Return the estimated remaining time of a partfile in seconds
+
+        Return 0 for complete partfiles and None when no estimate can be made
+        (no progress, paused or stalled partfiles).
+
+        """
+
+        if now is None:
+            now = time.time()
+        i = self._index[key]
+        remaining = self._size[i] - self._done[i]
+        if remaining <= 0:
+            return 0.0
+        if self._status[i] in _INACTIVE or self._is_stalled(i, now):
+            return None
+        speed = self._scaled[i] / self._scale(now)
+        if speed < 1.0:
+            return None
+        return remaining / speed
+
+    def item(self, key, now = None):
+        """Return a dict() with 'speed', 'eta', 'stalled' and 'remaining'"""
+        if now is None:
+            now = time.time()
+        i = self._index[key]
+        return {
+            'speed': self.speed(key, now),
+            'eta': self.eta(key, now),
+            'stalled': self._is_stalled(i, now),
+            'remaining': max(self._size[i] - self._done[i], 0)
+        }
+
+    def stalled_items(self, now = None):
+        """Return hashes of stalled partfiles (visits all partfiles)"""
+        if now is None:
+            now = time.time()
+        return [k for k, i in self._index.iteritems()
+                    if self._is_stalled(i, now)]
+
+    def fleet(self, now = None):
+        """Return fleet-wide aggregates
+
+        Return a dict() with 'count', 'size', 'done', 'remaining', 'speed'
+        (sum of smoothed speeds) and 'eta' (remaining / speed, or None).
+
+        """
+
+        if now is None:
+            now = time.time()
+        speed = max(self._scaled_sum / self._scale(now), 0.0)
+        remaining = max(self._total_size - self._total_done, 0.0)
+        eta = None
+        if remaining <= 0:
+            eta = 0.0
+        elif speed >= 1.0:
+            eta = remaining / speed
+        return {
+            'count': len(self._index),
+            'size': self._total_size,
+            'done': self._total_done,
+            'remaining': remaining,
+            'speed': speed,
+            'eta': eta
+        }
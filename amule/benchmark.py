@@ -0,0 +1,296 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Codec micro-benchmarks
+
+Measure packet encoding (ECTag.get_data, ECPacket.get_raw_packet), decoding
+(ECPacket._read_raw_packet, ec_read_utf8) and list mapping (decoder plans)
+throughput, as well as peak memory, on synthetic packets with realistic tag
+mixes:
+- 'partfiles': download queue with details (including source names)
+- 'knownfiles': shared files list
+- 'search': search results
+
+Each case runs in a separate process so that peak memory can be measured.
+Results are written as JSON and can be compared with a previous run:
+
+    python -m amule.benchmark -o new.json --compare old.json
+
+"""
+
+import hashlib
+import json
+import multiprocessing
+import optparse
+import resource
+import sys
+import time
+
+from eccodes import *
+from ectag import *
+from ecpacket import ECPacket
+from ecdecoder import compile_plan
+
+
+KINDS = ['partfiles', 'knownfiles', 'search']
+FLAGS = ['none', 'zlib', 'utf8', 'zlib+utf8']
+
+
+def _hash(i):
+    return hashlib.md5(str(i)).hexdigest()
+
+def make_packet(codes, kind, count):
+    """Build a synthetic response packet holding count items of kind
+
+    Return a (packet, operation) tuple, operation being the decoder plan
+    operation name for the packet.
+
+    """
+
+    if kind == 'partfiles':
+        packet = ECPacket(codes, opcode = codes.OP_DLOAD_QUEUE)
+        for i in range(count):
+            name = "Some.Movie.Title.%d.2009.DVDRip.XviD.avi" % i
+            size = 700 * 1024 * 1024 + i
+            tag = ECHash16Tag(_hash(i), codes.TAG_PARTFILE)
+            names = ECUInt32Tag(3, codes.TAG_PARTFILE_SOURCE_NAMES)
+            names.subtags = [
+                ECStringTag(name, codes.TAG_PARTFILE_SOURCE_NAMES),
+                ECStringTag(name.lower(), codes.TAG_PARTFILE_SOURCE_NAMES),
+                ECStringTag(name.replace(".", " "),
+                            codes.TAG_PARTFILE_SOURCE_NAMES)
+            ]
+            tag.subtags = [
+                ECStringTag(name, codes.TAG_PARTFILE_NAME),
+                ECUInt16Tag(i % 65536, codes.TAG_PARTFILE_PARTMETID),
+                ECUInt64Tag(size, codes.TAG_PARTFILE_SIZE_FULL),
+                ECUInt64Tag(size / 3, codes.TAG_PARTFILE_SIZE_XFER),
+                ECUInt64Tag(size / 2, codes.TAG_PARTFILE_SIZE_DONE),
+                ECUInt32Tag(i % 100000, codes.TAG_PARTFILE_SPEED),
+                ECUInt8Tag(EC_PS_READY, codes.TAG_PARTFILE_STATUS),
+                ECUInt8Tag(EC_PR_NORMAL, codes.TAG_PARTFILE_PRIO),
+                ECUInt16Tag(i % 300, codes.TAG_PARTFILE_SOURCE_COUNT),
+                ECUInt16Tag(0, codes.TAG_PARTFILE_SOURCE_COUNT_A4AF),
+                ECUInt16Tag(i % 10, codes.TAG_PARTFILE_SOURCE_COUNT_NOT_CURRENT),
+                ECUInt16Tag(i % 5, codes.TAG_PARTFILE_SOURCE_COUNT_XFER),
+                ECStringTag("ed2k://|file|%s|%d|%s|/" % (name, size, _hash(i)),
+                            codes.TAG_PARTFILE_ED2K_LINK),
+                ECUInt8Tag(0, codes.TAG_PARTFILE_CAT),
+                ECUInt32Tag(1234567890, codes.TAG_PARTFILE_LAST_RECV),
+                ECUInt32Tag(1234567890, codes.TAG_PARTFILE_LAST_SEEN_COMP),
+                names
+            ]
+            packet.tags.append(tag)
+        return (packet, 'download')
+
+    elif kind == 'knownfiles':
+        packet = ECPacket(codes, opcode = codes.OP_SHARED_FILES)
+        for i in range(count):
+            name = "Shared.File.%d.mp3" % i
+            size = 5 * 1024 * 1024 + i
+            tag = ECHash16Tag(_hash(i), codes.TAG_KNOWNFILE)
+            tag.subtags = [
+                ECStringTag(name, codes.TAG_PARTFILE_NAME),
+                ECUInt64Tag(size, codes.TAG_PARTFILE_SIZE_FULL),
+                ECStringTag("ed2k://|file|%s|%d|%s|/" % (name, size, _hash(i)),
+                            codes.TAG_PARTFILE_ED2K_LINK),
+                ECUInt8Tag(EC_PR_NORMAL, codes.TAG_PARTFILE_PRIO),
+                ECUInt64Tag(i * 1000, codes.TAG_KNOWNFILE_XFERRED),
+                ECUInt64Tag(i * 10000, codes.TAG_KNOWNFILE_XFERRED_ALL),
+                ECUInt16Tag(i % 10, codes.TAG_KNOWNFILE_REQ_COUNT),
+                ECUInt32Tag(i % 1000, codes.TAG_KNOWNFILE_REQ_COUNT_ALL),
+                ECUInt16Tag(i % 5, codes.TAG_KNOWNFILE_ACCEPT_COUNT),
+                ECUInt32Tag(i % 500, codes.TAG_KNOWNFILE_ACCEPT_COUNT_ALL),
+                ECStringTag("AICH%028d" % i,
+                            codes.TAG_KNOWNFILE_AICH_MASTERHASH)
+            ]
+            packet.tags.append(tag)
+        return (packet, 'shared')
+
+    elif kind == 'search':
+        packet = ECPacket(codes, opcode = codes.OP_SEARCH_RESULTS)
+        for i in range(count):
+            tag = ECHash16Tag(_hash(i), codes.TAG_SEARCHFILE)
+            tag.subtags = [
+                ECStringTag("Search Result %d.avi" % i, codes.TAG_PARTFILE_NAME),
+                ECUInt64Tag(i << 20, codes.TAG_PARTFILE_SIZE_FULL),
+                ECUInt32Tag(i % 200, codes.TAG_PARTFILE_SOURCE_COUNT),
+                ECUInt32Tag(i % 20, codes.TAG_PARTFILE_SOURCE_COUNT_XFER)
+            ]
+            packet.tags.append(tag)
+        return (packet, 'search')
+
+    raise ValueError("Unknown packet kind: %s" % kind)
+
+def _best(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        ret = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, ret
+
+def run_case(kind, count, flags, repeat = 3, version = 0x0203):
+    """Run one benchmark case in the current process
+
+    Return a dict() with timings (seconds, best of repeat runs), sizes and
+    peak memory growth (kilobytes).
+
+    """
+
+    codes = ec_get_codes(version)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    packet, operation = make_packet(codes, kind, count)
+    if 'zlib' in flags:
+        packet.set_flag(codes.FLAG_ZLIB)
+    if 'utf8' in flags:
+        packet.set_flag(codes.FLAG_UTF8_NUMBERS)
+
+    encode_s, raw = _best(lambda: packet.get_raw_packet(codes), repeat)
+    decode_s, decoded = _best(lambda: ECPacket(codes, rawdata = raw), repeat)
+    plan = compile_plan(codes, operation)
+    map_s, items = _best(lambda: plan.decode_list(decoded, []), repeat)
+
+    utf8_s = None
+    if 'utf8' in flags:
+        from cStringIO import StringIO
+        numbers = "".join([ec_number_to_utf8(i * 7 % 0xFFFF)
+                            for i in range(count * 10)])
+        def read_numbers():
+            buf = StringIO(numbers)
+            for i in xrange(count * 10):
+                ec_read_utf8(buf)
+        utf8_s, dummy = _best(read_numbers, repeat)
+
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tags = count * (len(packet.tags[0].subtags) + 1) if count else 0
+
+    return {
+        'case': "%s-%d-%s" % (kind, count, flags),
+        'kind': kind,
+        'items': count,
+        'tags': tags,
+        'flags': flags,
+        'raw_bytes': len(raw),
+        'encode_s': encode_s,
+        'decode_s': decode_s,
+        'map_s': map_s,
+        'utf8_read_s': utf8_s,
+        'peak_rss_kb': rss_end - rss_start
+    }
+
+def _child(queue, args):
+    try:
+        queue.put(run_case(*args))
+    except Exception, e:
+        queue.put({'case': "%s-%d-%s" % args[:3], 'error': str(e)})
+
+def run_isolated(kind, count, flags, repeat = 3, version = 0x0203):
+    """Run one benchmark case in a child process, see run_case()"""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target = _child,
+                    args = (queue, (kind, count, flags, repeat, version)))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def compare(old, new, threshold = 0.10):
+    """Compare two result lists
+
+    Return a list of (case, metric, old value, new value, ratio) tuples for
+    timings and memory that grew by more than threshold.
+
+    """
+
+    old_cases = dict([(r['case'], r) for r in old if not r.has_key('error')])
+    regressions = []
+    for r in new:
+        o = old_cases.get(r['case'])
+        if o is None or r.has_key('error'):
+            continue
+        for metric in ('encode_s', 'decode_s', 'map_s', 'utf8_read_s',
+                        'peak_rss_kb'):
+            if not o.get(metric) or r.get(metric) is None:
+                continue
+            ratio = float(r[metric]) / o[metric]
+            if ratio > 1 + threshold:
+                regressions.append((r['case'], metric, o[metric], r[metric],
+                                    ratio))
+    return regressions
+
+def main(argv = None):
+    parser = optparse.OptionParser(usage = "%prog [options]")
+    parser.add_option("-s", "--sizes", default = "10,1000,10000",
+                        help = "comma-separated item counts [%default]")
+    parser.add_option("-k", "--kinds", default = ",".join(KINDS),
+                        help = "comma-separated packet kinds [%default]")
+    parser.add_option("-f", "--flags", default = ",".join(FLAGS),
+                        help = "comma-separated flag sets [%default]")
+    parser.add_option("-r", "--repeat", type = "int", default = 3,
+                        help = "runs per measure, best is kept [%default]")
+    parser.add_option("-o", "--output", help = "write JSON results to file")
+    parser.add_option("-c", "--compare",
+                        help = "compare with JSON results from file")
+    parser.add_option("-t", "--threshold", type = "float", default = 0.10,
+                        help = "regression threshold ratio [%default]")
+    options, args = parser.parse_args(argv)
+
+    results = []
+    for kind in options.kinds.split(","):
+        for size in [int(s) for s in options.sizes.split(",")]:
+            for flags in options.flags.split(","):
+                r = run_isolated(kind, size, flags, options.repeat)
+                results.append(r)
+                if r.has_key('error'):
+                    print "%-28s error: %s" % (r['case'], r['error'])
+                    continue
+                print "%-28s %9d B  enc %8.4fs  dec %8.4fs  map %8.4fs  " \
+                      "rss +%d kB" % (r['case'], r['raw_bytes'],
+                                      r['encode_s'], r['decode_s'],
+                                      r['map_s'], r['peak_rss_kb'])
+
+    if options.output:
+        f = open(options.output, "w")
+        try:
+            json.dump({
+                'python': sys.version,
+                'timestamp': time.time(),
+                'results': results
+            }, f, indent = 1)
+        finally:
+            f.close()
+
+    if options.compare:
+        f = open(options.compare)
+        try:
+            old = json.load(f)['results']
+        finally:
+            f.close()
+        regressions = compare(old, results, options.threshold)
+        for case, metric, o, n, ratio in regressions:
+            print "REGRESSION %-28s %-12s %s -> %s (x%.2f)" % (case, metric,
+                                                                o, n, ratio)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
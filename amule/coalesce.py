@@ -0,0 +1,197 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Single-flight request coalescing
+
+CoalescingClient wraps an AmuleClient (used by one thread at a time through a
+lock) or an AmuleClientPool for use by many threads.  While a read request is
+in flight, threads making an identical request (same method and arguments)
+wait for it and get the same result instead of making another round trip:
+
+    client = CoalescingClient(AmuleClientPool(host, port, password))
+    status = client.get_server_status()
+
+Results are shared between callers and must be treated as read-only.
+Incremental update requests (update = True) depend on per-connection state
+and are never coalesced, nor are deferred requests and requests with side
+effects; all other methods are passed through.
+
+"""
+
+import inspect
+import sys
+import threading
+
+from amule import AmuleClient
+from pool import AmuleClientPool
+
+
+# Coalesced methods
+COALESCED = ('get_server_status', 'get_stats_tree', 'get_log',
+             'get_debug_log', 'get_server_info', 'get_last_log_entry',
+             'get_search_progress', 'get_server_list', 'get_search_results',
+             'get_shared_list', 'get_download_list', 'get_upload_queue',
+             'get_wait_queue')
+
+
+def _freeze(value):
+    """Return a hashable equivalent of an argument value"""
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(v) for v in value])
+    if isinstance(value, dict):
+        items = [(k, _freeze(v)) for k, v in value.iteritems()]
+        items.sort()
+        return tuple(items)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CoalescingClient:
+    """Thread-safe client coalescing identical concurrent read requests
+
+    target is either an AmuleClient, whose requests are then serialized, or
+    an AmuleClientPool, in which case distinct requests run in parallel on
+    pooled clients.
+
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._pooled = isinstance(target, AmuleClientPool)
+        self._client_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._signatures = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    def _call(self, name, args, kwargs):
+        if self._pooled:
+            client = self.target.acquire()
+            try:
+                ret = getattr(client, name)(*args, **kwargs)
+            except:
+                self.target.release(client, True)
+                raise
+            self.target.release(client)
+            return ret
+
+        self._client_lock.acquire()
+        try:
+            return getattr(self.target, name)(*args, **kwargs)
+        finally:
+            self._client_lock.release()
+
+    def _callargs(self, name, args, kwargs):
+        """Return a dict() of all arguments of a call, defaults included"""
+        signature = self._signatures.get(name)
+        if signature is None:
+            spec = inspect.getargspec(getattr(AmuleClient, name))
+            names = spec.args[1:]
+            defaults = dict(zip(names[len(names) - len(spec.defaults or ()):],
+                                spec.defaults or ()))
+            signature = (names, defaults)
+            self._signatures[name] = signature
+
+        names, defaults = signature
+        if len(args) > len(names):
+            raise TypeError("%s() takes at most %d arguments (%d given)" % (
+                                name, len(names), len(args)))
+        callargs = dict(defaults)
+        callargs.update(zip(names, args))
+        for key, value in kwargs.iteritems():
+            if key not in names:
+                raise TypeError("%s() got an unexpected keyword argument "
+                                "'%s'" % (name, key))
+            callargs[key] = value
+        return callargs
+
+    def _coalesce(self, name, args, kwargs):
+        callargs = self._callargs(name, args, kwargs)
+        if callargs.get('update') or callargs.get('deferred'):
+            # Incremental updates depend on per-connection state, and deferred
+            # results are not meant to be shared
+            return self._call(name, args, kwargs)
+
+        try:
+            key = (name, _freeze(callargs))
+            hash(key)
+        except TypeError:
+            return self._call(name, args, kwargs)
+
+        while 1:
+            self._lock.acquire()
+            try:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+                    self.requests = self.requests + 1
+                else:
+                    self.coalesced = self.coalesced + 1
+            finally:
+                self._lock.release()
+
+            if leader:
+                break
+
+            flight.done.wait()
+            if flight.error is None:
+                return flight.result
+            if isinstance(flight.error, Exception):
+                raise flight.error
+            # The leader was interrupted (KeyboardInterrupt, SystemExit...),
+            # which does not concern this thread: try again
+
+        try:
+            try:
+                flight.result = self._call(name, args, kwargs)
+            except:
+                flight.error = sys.exc_info()[1]
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del(self._flights[key])
+            finally:
+                self._lock.release()
+            flight.done.set()
+
+        return flight.result
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in COALESCED:
+            def method(*args, **kwargs):
+                return self._coalesce(name, args, kwargs)
+        else:
+            def method(*args, **kwargs):
+                return self._call(name, args, kwargs)
+
+        method.__name__ = name
+        return method
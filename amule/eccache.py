@@ -0,0 +1,67 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+
+class ECLRUCache:
+    """Small least-recently-used cache
+
+    Holds at most size entries; when full, the least recently used entry is
+    evicted.  When max_age is not None, entries older than max_age seconds
+    are considered missing.
+
+    """
+
+    def __init__(self, size, max_age = None):
+        self.size = size
+        self.max_age = max_age
+        self._entries = {}
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default = None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        value, stored, used = entry
+        if self.max_age is not None and time.time() - stored > self.max_age:
+            del(self._entries[key])
+            return default
+
+        self._counter = self._counter + 1
+        self._entries[key] = (value, stored, self._counter)
+        return value
+
+    def put(self, key, value):
+        entries = self._entries
+        if not entries.has_key(key) and len(entries) >= self.size:
+            oldest = min(entries.iteritems(), key = lambda e: e[1][2])[0]
+            del(entries[oldest])
+
+        self._counter = self._counter + 1
+        entries[key] = (value, time.time(), self._counter)
+
+    def discard(self, key):
+        if self._entries.has_key(key):
+            del(self._entries[key])
+
+    def clear(self):
+        self._entries = {}
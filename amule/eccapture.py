@@ -0,0 +1,251 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""EC session capture and replay
+
+Capture files hold raw EC frames (8-byte header and application data, as
+they went on the wire) exchanged by an AmuleClient (see
+AmuleClient.start_capture()).  They start with a 'ECCAP' magic string and a
+format number, followed by records made of:
+- direction (uint8, CAPTURE_SENT or CAPTURE_RECV)
+- timestamp (double)
+- protocol version in use (uint16)
+- frame length (uint32) and frame data
+
+Records are only ever appended, so several sessions may be captured to the
+same file.  Captured frames can be decoded again with replay_packets(), or
+served to an AmuleClient through a fake connection with replay_client():
+
+    python -m amule.eccapture session.cap
+
+"""
+
+import optparse
+import struct
+import sys
+import threading
+import time
+from cStringIO import StringIO
+
+from eccodes import ec_get_codes
+from ecpacket import ECPacket, ec_frame_appdata
+
+
+CAPTURE_MAGIC = 'ECCAP'
+CAPTURE_FORMAT = 1
+
+CAPTURE_SENT = 0
+CAPTURE_RECV = 1
+
+_RECORD = struct.Struct("!BdHI")
+
+# Chunk size used when writing large frame data
+_CHUNK = 1 << 20
+
+
+class ECCaptureError(Exception): pass
+
+
+class ECCaptureWriter:
+    """Append-only capture file writer
+
+    Writes are serialized so that a writer may be shared between clients.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC + struct.pack("!H", CAPTURE_FORMAT))
+            self._file.flush()
+
+    def write(self, direction, timestamp, version, frame, data = ''):
+        """Append a frame record
+
+        The record holds frame followed by data, which may be a string or a
+        memory-mapped spilled frame (see ecpacket.ECFrameLimits); data is
+        written in chunks so that large frames are not copied in memory.
+
+        """
+
+        self._lock.acquire()
+        try:
+            self._file.write(_RECORD.pack(direction, timestamp, version or 0,
+                                            len(frame) + len(data)))
+            self._file.write(frame)
+            if isinstance(data, str):
+                self._file.write(data)
+            else:
+                for pos in xrange(0, len(data), _CHUNK):
+                    self._file.write(data[pos:pos + _CHUNK])
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._file.close()
+        finally:
+            self._lock.release()
+
+
+def read_capture(path):
+    """Generate (direction, timestamp, version, frame) tuples from a capture
+
+    Raise ECCaptureError when path is not a capture file.  A truncated last
+    record (eg. from an interrupted capture) is ignored.
+
+    """
+
+    f = open(path, "rb")
+    try:
+        head = f.read(len(CAPTURE_MAGIC) + 2)
+        if len(head) < len(CAPTURE_MAGIC) + 2 or \
+                not head.startswith(CAPTURE_MAGIC):
+            raise ECCaptureError("Not a capture file: %s" % path)
+        fmt = struct.unpack("!H", head[len(CAPTURE_MAGIC):])[0]
+        if fmt != CAPTURE_FORMAT:
+            raise ECCaptureError("Unsupported capture format: %d" % fmt)
+
+        size = _RECORD.size
+        while 1:
+            record = f.read(size)
+            if len(record) < size:
+                break
+            direction, timestamp, version, length = _RECORD.unpack(record)
+            frame = f.read(length)
+            if len(frame) < length:
+                break
+            yield (direction, timestamp, version, frame)
+    finally:
+        f.close()
+
+def _frame_opcode(codes, frame):
+    flags = struct.unpack("!I", frame[:4])[0]
+    return ord(ec_frame_appdata(codes, flags, frame[8:])[0])
+
+def replay_packets(path, direction = CAPTURE_RECV):
+    """Generate (timestamp, version, ECPacket) tuples from a capture
+
+    Only frames in direction are decoded (both when direction is None).
+
+    """
+
+    for d, timestamp, version, frame in read_capture(path):
+        if direction is not None and d != direction:
+            continue
+        packet = ECPacket(ec_get_codes(version), rawdata = frame)
+        yield (timestamp, version, packet)
+
+
+class _NullFile:
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def replay_client(path, skip_auth = True):
+    """Return an AmuleClient serving responses from a capture
+
+    The client is set up as if connected with the protocol version of the
+    first captured response; its requests are discarded and its responses
+    are read from captured received frames, in order.  Requests must thus be
+    made in the same order as in the captured session.  When skip_auth is
+    True, authentication responses are skipped.
+
+    """
+
+    from amule import AmuleClient
+
+    frames = []
+    version = None
+    for d, timestamp, v, frame in read_capture(path):
+        if d != CAPTURE_RECV:
+            continue
+        codes = ec_get_codes(v)
+        if skip_auth and _frame_opcode(codes, frame) in (codes.OP_AUTH_OK,
+                        codes.OP_AUTH_FAIL, getattr(codes, 'OP_AUTH_SALT', -1)):
+            continue
+        if version is None:
+            version = v
+        frames.append(frame)
+
+    if version is None:
+        raise ECCaptureError("No response frames in capture: %s" % path)
+
+    client = AmuleClient()
+    client.protocol_version = version
+    client.codes = ec_get_codes(version)
+    client._wfile = _NullFile()
+    client._rfile = StringIO("".join(frames))
+    return client
+
+
+def main(argv = None):
+    parser = optparse.OptionParser(usage = "%prog [options] capture")
+    parser.add_option("-r", "--repeat", type = "int", default = 1,
+                        help = "decode frames repeat times [%default]")
+    parser.add_option("-a", "--all", action = "store_true", default = False,
+                        help = "decode sent frames too")
+    parser.add_option("-d", "--dump", action = "store_true", default = False,
+                        help = "dump decoded packets")
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("no capture file given")
+
+    direction = CAPTURE_RECV
+    if options.all:
+        direction = None
+
+    frames = [(ec_get_codes(v), frame)
+                for d, ts, v, frame in read_capture(args[0])
+                if direction is None or d == direction]
+    size = sum([len(frame) for codes, frame in frames])
+
+    best = None
+    for i in range(options.repeat):
+        start = time.time()
+        for codes, frame in frames:
+            ECPacket(codes, rawdata = frame)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    if options.dump:
+        for codes, frame in frames:
+            print ECPacket(codes, rawdata = frame).dump(codes)
+
+    print "%d frames, %d bytes decoded in %.4fs (%.1f MB/s)" % (len(frames),
+                size, best, size / (best or 1e-9) / 1048576)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
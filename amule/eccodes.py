@@ -56,11 +56,34 @@ EC_PR_VERYHIGH         = 3
 EC_PR_AUTO             = 5
 EC_PR_POWERSHARE       = 6
 
+# Preference sections (TAG_SELECT_PREFS bitmask)
+EC_PREFS_CATEGORIES     = 0x00000001
+EC_PREFS_GENERAL        = 0x00000002
+EC_PREFS_CONNECTIONS    = 0x00000004
+EC_PREFS_MESSAGEFILTER  = 0x00000008
+EC_PREFS_REMOTECONTROLS = 0x00000010
+EC_PREFS_ONLINESIG      = 0x00000020
+EC_PREFS_SERVERS        = 0x00000040
+EC_PREFS_FILES          = 0x00000080
+EC_PREFS_SRCDROP        = 0x00000100
+EC_PREFS_DIRECTORIES    = 0x00000200
+EC_PREFS_STATISTICS     = 0x00000400
+EC_PREFS_SECURITY       = 0x00000800
+EC_PREFS_CORETWEAKS     = 0x00001000
+EC_PREFS_KADEMLIA       = 0x00002000
+
 EC_KNOWN_VERSIONS = [0x0200, 0x0203]
 
 class ECVersionError(Exception): pass
+class ECReadOnlyError(AttributeError): pass
 
 class ECCodes:
+    """Protocol codes for a given protocol version
+
+    Instances are immutable once built.  Use ec_get_codes() to get the shared
+    instance for a version instead of building a new one.
+
+    """
 
     def __init__(self, version):
         if version not in EC_KNOWN_VERSIONS:
@@ -404,4 +427,46 @@ class ECCodes:
         self.TAG_PREFS_KADEMLIA                     = 0x1E00
         self.TAG_KADEMLIA_UPDATE_URL                = 0x1E01
 
+        # Reverse lookup tables
+        opcodes = {}
+        tags = {}
+        for name, value in self.__dict__.items():
+            if name.startswith('OP_'):
+                opcodes[value] = name
+            elif name.startswith('TAG_'):
+                tags[value] = name
+        self._opcode_names = opcodes
+        self._tag_names = tags
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen'):
+            raise ECReadOnlyError("ECCodes instances are read-only")
+        self.__dict__[name] = value
+
+    def __delattr__(self, name):
+        raise ECReadOnlyError("ECCodes instances are read-only")
+
+    def opcode_name(self, opcode):
+        """Return the name of opcode (eg. 'OP_NOOP'), or None if unknown"""
+        return self._opcode_names.get(opcode)
+
+    def tag_name(self, tagname):
+        """Return the name of tag tagname (eg. 'TAG_STRING'), or None"""
+        return self._tag_names.get(tagname)
+
+
+_codes = {}
+
+def ec_get_codes(version):
+    """Get the shared ECCodes instance for version
+
+    Instances are built on first use and then shared by all callers.
+
+    """
 
+    codes = _codes.get(version)
+    if codes is None:
+        codes = ECCodes(version)
+        _codes[version] = codes
+    return codes
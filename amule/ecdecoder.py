@@ -0,0 +1,409 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled response decoders
+
+Responses are decoded using plans compiled from the field tables below for a
+given ECCodes instance.  A field table entry is a tuple:
+
+    (tag attribute name, result key, minimum protocol version,
+     list subtag attribute name or None, converter or None)
+
+When a list subtag name is given, the result value is a list holding values
+of the subtags with that name.  When a converter is given, it is called with
+the tag value and its result is stored instead.
+
+"""
+
+from eccodes import EC_TAGTYPE_CUSTOM, EC_PREFS_CATEGORIES, EC_PREFS_GENERAL, \
+        EC_PREFS_CONNECTIONS, EC_PREFS_MESSAGEFILTER, EC_PREFS_REMOTECONTROLS, \
+        EC_PREFS_ONLINESIG, EC_PREFS_SERVERS, EC_PREFS_FILES, EC_PREFS_SRCDROP, \
+        EC_PREFS_DIRECTORIES, EC_PREFS_STATISTICS, EC_PREFS_SECURITY, \
+        EC_PREFS_CORETWEAKS, EC_PREFS_KADEMLIA
+from ecstrings import ec_text
+
+
+def _field(attr, key, since = 0x0200, sublist = None, convert = None):
+    return (attr, key, since, sublist, convert)
+
+
+STATUS_FIELDS = [
+    _field('TAG_STATS_UL_SPEED', 'ul_speed'),
+    _field('TAG_STATS_DL_SPEED', 'dl_speed'),
+    _field('TAG_STATS_UL_SPEED_LIMIT', 'ul_speed_limit'),
+    _field('TAG_STATS_DL_SPEED_LIMIT', 'dl_speed_limit'),
+    _field('TAG_STATS_UL_QUEUE_LEN', 'ul_queue_len'),
+    _field('TAG_STATS_TOTAL_SRC_COUNT', 'total_src_count'),
+    _field('TAG_STATS_ED2K_USERS', 'ed2k_users'),
+    _field('TAG_STATS_KAD_USERS', 'kad_users'),
+    _field('TAG_STATS_ED2K_FILES', 'ed2k_files'),
+    _field('TAG_STATS_KAD_FILES', 'kad_files'),
+    _field('TAG_CONNSTATE', 'connstate'),
+    _field('TAG_STATS_KAD_FIREWALLED_UDP', 'kad_firewalled_udp', 0x0203),
+    _field('TAG_STATS_KAD_INDEXED_SOURCES', 'kad_indexed_sources', 0x0203),
+    _field('TAG_STATS_KAD_INDEXED_KEYWORDS', 'kad_indexed_keywords', 0x0203),
+    _field('TAG_STATS_KAD_INDEXED_NOTES', 'kad_indexed_notes', 0x0203),
+    _field('TAG_STATS_KAD_INDEXED_LOAD', 'kad_indexed_load', 0x0203),
+    _field('TAG_STATS_KAD_IP_ADRESS', 'kad_ip_address', 0x0203),
+    _field('TAG_STATS_BUDDY_STATUS', 'buddy_status', 0x0203),
+    _field('TAG_STATS_BUDDY_IP', 'buddy_ip', 0x0203),
+    _field('TAG_STATS_BUDDY_PORT', 'buddy_port', 0x0203)
+]
+
+SEARCH_FIELDS = [
+    _field('TAG_PARTFILE_SOURCE_COUNT', 'src_count'),
+    _field('TAG_PARTFILE_SOURCE_COUNT_XFER', 'src_count_xfer'),
+    _field('TAG_PARTFILE_NAME', 'name'),
+    _field('TAG_PARTFILE_SIZE_FULL', 'size')
+]
+
+SHARED_FIELDS = [
+    _field('TAG_PARTFILE_NAME', 'name'),
+    _field('TAG_PARTFILE_SIZE_FULL', 'size'),
+    _field('TAG_PARTFILE_ED2K_LINK', 'ed2k_link'),
+    _field('TAG_PARTFILE_PRIO', 'prio'),
+    _field('TAG_KNOWNFILE_XFERRED', 'xferred'),
+    _field('TAG_KNOWNFILE_XFERRED_ALL', 'xferred_all'),
+    _field('TAG_KNOWNFILE_REQ_COUNT', 'req_count'),
+    _field('TAG_KNOWNFILE_REQ_COUNT_ALL', 'req_count_all'),
+    _field('TAG_KNOWNFILE_ACCEPT_COUNT', 'accept_count'),
+    _field('TAG_KNOWNFILE_ACCEPT_COUNT_ALL', 'accept_count_all'),
+    _field('TAG_KNOWNFILE_AICH_MASTERHASH', 'aich_masterhash')
+]
+
+DOWNLOAD_FIELDS = [
+    _field('TAG_PARTFILE_STATUS', 'status'),
+    _field('TAG_PARTFILE_SOURCE_COUNT', 'src_count'),
+    _field('TAG_PARTFILE_SOURCE_COUNT_NOT_CURRENT', 'src_count_not_current'),
+    _field('TAG_PARTFILE_SOURCE_COUNT_XFER', 'src_count_xfer'),
+    _field('TAG_PARTFILE_SOURCE_COUNT_A4AF', 'src_count_a4af'),
+    _field('TAG_PARTFILE_NAME', 'name'),
+    _field('TAG_PARTFILE_SIZE_XFER', 'size_xfer'),
+    _field('TAG_PARTFILE_SIZE_DONE', 'size_done'),
+    _field('TAG_PARTFILE_SIZE_FULL', 'size'),
+    _field('TAG_PARTFILE_SPEED', 'speed'),
+    _field('TAG_PARTFILE_PRIO', 'prio'),
+    _field('TAG_PARTFILE_CAT', 'cat'),
+    _field('TAG_PARTFILE_LAST_SEEN_COMP', 'last_seen_comp'),
+    _field('TAG_PARTFILE_LAST_RECV', 'last_recv'),
+    _field('TAG_PARTFILE_PARTMETID', 'partmetid'),
+    _field('TAG_PARTFILE_ED2K_LINK', 'ed2k_link'),
+    _field('TAG_PARTFILE_SOURCE_NAMES', 'source_names',
+        sublist = 'TAG_PARTFILE_SOURCE_NAMES'),
+    _field('TAG_PARTFILE_LOST_CORRUPTION', 'lost_corruption', 0x0203),
+    _field('TAG_PARTFILE_GAINED_COMPRESSION', 'gained_compression', 0x0203),
+    _field('TAG_PARTFILE_SAVED_ICH', 'saved_ich', 0x0203),
+    _field('TAG_PARTFILE_STOPPED', 'stopped', 0x0203),
+    _field('TAG_PARTFILE_DOWNLOAD_ACTIVE', 'download_active', 0x0203)
+]
+
+CLIENT_FIELDS = [
+    _field('TAG_CLIENT_NAME', 'name'),
+    _field('TAG_CLIENT_SOFTWARE', 'software'),
+    _field('TAG_CLIENT_SOFT_VER_STR', 'software_version'),
+    _field('TAG_CLIENT_STATE', 'state'),
+    _field('TAG_CLIENT_SCORE', 'score'),
+    _field('TAG_CLIENT_UP_SPEED', 'up_speed'),
+    _field('TAG_CLIENT_DOWN_SPEED', 'down_speed'),
+    _field('TAG_CLIENT_UPLOAD_SESSION', 'upload_session'),
+    _field('TAG_CLIENT_UPLOAD_TOTAL', 'upload_total'),
+    _field('TAG_CLIENT_DOWNLOAD_TOTAL', 'download_total'),
+    _field('TAG_CLIENT_WAITING_POSITION', 'waiting_position'),
+    _field('TAG_CLIENT_USER_IP', 'user_ip'),
+    _field('TAG_CLIENT_USER_PORT', 'user_port'),
+    _field('TAG_KNOWNFILE', 'file_hash'),
+    _field('TAG_PARTFILE_NAME', 'file_name'),
+    _field('TAG_CLIENT_OBFUSCATED_CONNECTION', 'obfuscated', 0x0203),
+    _field('TAG_CLIENT_REMOTE_QUEUE_RANK', 'remote_queue_rank', 0x0203),
+    _field('TAG_CLIENT_ASKED_COUNT', 'asked_count', 0x0203)
+]
+
+SERVER_FIELDS = [
+    _field('TAG_SERVER_NAME', 'name'),
+    _field('TAG_SERVER_DESC', 'desc'),
+    _field('TAG_SERVER_ADDRESS', 'address'),
+    _field('TAG_SERVER_PING', 'ping'),
+    _field('TAG_SERVER_USERS', 'users'),
+    _field('TAG_SERVER_USERS_MAX', 'users_max'),
+    _field('TAG_SERVER_FILES', 'files'),
+    _field('TAG_SERVER_PRIO', 'prio'),
+    _field('TAG_SERVER_FAILED', 'failed'),
+    _field('TAG_SERVER_STATIC', 'static'),
+    _field('TAG_SERVER_VERSION', 'version')
+]
+
+# Operation name -> (item tag attribute name or None, field table)
+OPERATIONS = {
+    'status': (None, STATUS_FIELDS),
+    'search': ('TAG_SEARCHFILE', SEARCH_FIELDS),
+    'shared': ('TAG_KNOWNFILE', SHARED_FIELDS),
+    'download': ('TAG_PARTFILE', DOWNLOAD_FIELDS),
+    'client': ('TAG_CLIENT', CLIENT_FIELDS),
+    'server': ('TAG_SERVER', SERVER_FIELDS)
+}
+
+# Preference section name -> (TAG_SELECT_PREFS bit, section tag attribute name)
+PREFS_SECTIONS = {
+    'categories': (EC_PREFS_CATEGORIES, 'TAG_PREFS_CATEGORIES'),
+    'general': (EC_PREFS_GENERAL, 'TAG_PREFS_GENERAL'),
+    'connections': (EC_PREFS_CONNECTIONS, 'TAG_PREFS_CONNECTIONS'),
+    'messagefilter': (EC_PREFS_MESSAGEFILTER, 'TAG_PREFS_MESSAGEFILTER'),
+    'remotecontrols': (EC_PREFS_REMOTECONTROLS, 'TAG_PREFS_REMOTECTRL'),
+    'onlinesig': (EC_PREFS_ONLINESIG, 'TAG_PREFS_ONLINESIG'),
+    'servers': (EC_PREFS_SERVERS, 'TAG_PREFS_SERVERS'),
+    'files': (EC_PREFS_FILES, 'TAG_PREFS_FILES'),
+    'srcdrop': (EC_PREFS_SRCDROP, 'TAG_PREFS_SRCDROP'),
+    'directories': (EC_PREFS_DIRECTORIES, 'TAG_PREFS_DIRECTORIES'),
+    'statistics': (EC_PREFS_STATISTICS, 'TAG_PREFS_STATISTICS'),
+    'security': (EC_PREFS_SECURITY, 'TAG_PREFS_SECURITY'),
+    'coretweaks': (EC_PREFS_CORETWEAKS, 'TAG_PREFS_CORETWEAKS'),
+    'kademlia': (EC_PREFS_KADEMLIA, 'TAG_PREFS_KADEMLIA')
+}
+
+
+def pref_key(codes, tagname):
+    """Return the preference key for tagname (eg. 'conn_max_dl')"""
+    name = codes.tag_name(tagname)
+    if name is None:
+        return "0x%04x" % tagname
+    return name[4:].lower()
+
+def decode_prefs(codes, tags):
+    """Decode preference tags into a dict()
+
+    Keys are built with pref_key().  Empty tags (which amuled uses for boolean
+    preferences that are set) are decoded as True.  Tags with subtags are
+    decoded as dicts, with their own value under the 'value' key.  Repeated
+    keys are decoded as lists.
+
+    """
+
+    ret = {}
+    for t in tags:
+        empty = t.type == EC_TAGTYPE_CUSTOM and t.value == ''
+        if t.subtags:
+            value = decode_prefs(codes, t.subtags)
+            if not empty:
+                value['value'] = t.value
+        elif empty:
+            value = True
+        else:
+            value = t.value
+
+        key = pref_key(codes, t.name)
+        if ret.has_key(key):
+            if not isinstance(ret[key], list):
+                ret[key] = [ret[key]]
+            ret[key].append(value)
+        else:
+            ret[key] = value
+    return ret
+
+
+class ECRecord(object):
+    """Base class for decoded item records
+
+    Subclasses are built by ECDecoderPlan with one slot per decoded field.
+    Fields not present in the decoded item are set to None.
+
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        for key in self.__slots__:
+            setattr(self, key, None)
+
+    def as_dict(self):
+        """Return a dict() holding fields that are not None"""
+        ret = {}
+        for key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None:
+                ret[key] = value
+        return ret
+
+    def text(self, key, errors = 'replace'):
+        """Return field key decoded as unicode text (see ecstrings.ec_text)"""
+        return ec_text(getattr(self, key), errors)
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.as_dict())
+
+
+class ECDecoderPlan:
+    """Compiled decoder for one operation and one protocol version
+
+    Holds a dispatch table mapping tag names to (key, list subtag name,
+    converter) tuples, built once from a field table.
+
+    """
+
+    def __init__(self, codes, item_tag, fields, name = 'Item'):
+        version = codes.CURRENT_PROTOCOL_VERSION
+
+        if item_tag is None:
+            self.item_tag = None
+        else:
+            self.item_tag = getattr(codes, item_tag)
+
+        self.keys = []
+        self.dispatch = {}
+        self._compact_dispatch = {}
+        for attr, key, since, sublist, convert in fields:
+            if version < since:
+                continue
+            if sublist is not None:
+                sublist = getattr(codes, sublist)
+            self.dispatch[getattr(codes, attr)] = (key, sublist, convert)
+            self._compact_dispatch[getattr(codes, attr)] = (len(self.keys),
+                                                            sublist, convert)
+            self.keys.append(key)
+
+        self.record_class = type("%sRecord" % name, (ECRecord,),
+                                    {'__slots__': tuple(self.keys)})
+
+    def decode_item(self, tags):
+        """Decode a list of tags into a dict()"""
+        dispatch = self.dispatch
+        item = {}
+        for t in tags:
+            entry = dispatch.get(t.name)
+            if entry is None:
+                continue
+            key, sublist, convert = entry
+            if sublist is not None:
+                item[key] = [sst.value for sst in t.subtags
+                                if sst.name == sublist]
+            elif convert is not None:
+                item[key] = convert(t.value)
+            else:
+                item[key] = t.value
+        return item
+
+    def decode_record(self, tags):
+        """Decode a list of tags into a record"""
+        dispatch = self.dispatch
+        item = self.record_class()
+        for t in tags:
+            entry = dispatch.get(t.name)
+            if entry is None:
+                continue
+            key, sublist, convert = entry
+            if sublist is not None:
+                setattr(item, key, [sst.value for sst in t.subtags
+                                        if sst.name == sublist])
+            elif convert is not None:
+                setattr(item, key, convert(t.value))
+            else:
+                setattr(item, key, t.value)
+        return item
+
+    def decode_linear(self, packet, ok_opcodes):
+        """Decode packet tags into a dict()
+
+        The result has an 'ok' item which is True if the packet opcode is in
+        ok_opcodes, and an item for each decoded tag.
+
+        """
+
+        ret = self.decode_item(packet.tags)
+        ret['ok'] = packet.opcode in ok_opcodes
+        return ret
+
+    def decode_list(self, packet, ok_opcodes, records = False):
+        """Decode packet item tags into a dict()
+
+        The result has an 'ok' item as in decode_linear() and an 'items' item,
+        which is a dict() with item tag values as keys and decoded subtags as
+        values.  Values are dicts, or records (instances of record_class) when
+        records is True.
+
+        """
+
+        item_tag = self.item_tag
+        if records:
+            decode_item = self.decode_record
+        else:
+            decode_item = self.decode_item
+        items = {}
+        for t in packet.tags:
+            if t.name == item_tag:
+                items[t.value] = decode_item(t.subtags)
+
+        return {'ok': packet.opcode in ok_opcodes, 'items': items}
+
+    def decode_compact(self, packet, ok_opcodes):
+        """Decode packet item tags into a compact form
+
+        Return an (ok, rows) tuple, ok being as in decode_list() and rows a
+        list of (item tag value, values) tuples, values holding decoded fields
+        in self.keys order (None for fields that are not present).  Compact
+        results only hold builtin types and are cheap to pickle; expand them
+        with expand_compact().
+
+        """
+
+        item_tag = self.item_tag
+        dispatch = self._compact_dispatch
+        blank = [None] * len(self.keys)
+        rows = []
+        for t in packet.tags:
+            if t.name != item_tag:
+                continue
+            values = blank[:]
+            for st in t.subtags:
+                entry = dispatch.get(st.name)
+                if entry is None:
+                    continue
+                index, sublist, convert = entry
+                if sublist is not None:
+                    values[index] = [sst.value for sst in st.subtags
+                                        if sst.name == sublist]
+                elif convert is not None:
+                    values[index] = convert(st.value)
+                else:
+                    values[index] = st.value
+            rows.append((t.value, tuple(values)))
+
+        return (packet.opcode in ok_opcodes, rows)
+
+    def expand_compact(self, compact, records = False):
+        """Expand a decode_compact() result as decode_list() would return it"""
+        ok, rows = compact
+        keys = self.keys
+        items = {}
+        if records:
+            record_class = self.record_class
+            for value, values in rows:
+                item = record_class()
+                for key, v in zip(keys, values):
+                    if v is not None:
+                        setattr(item, key, v)
+                items[value] = item
+        else:
+            for value, values in rows:
+                items[value] = dict([(key, v) for key, v in zip(keys, values)
+                                        if v is not None])
+
+        return {'ok': ok, 'items': items}
+
+
+def compile_plan(codes, operation):
+    """Compile a decoder plan for operation using codes"""
+    item_tag, fields = OPERATIONS[operation]
+    return ECDecoderPlan(codes, item_tag, fields, operation.capitalize())
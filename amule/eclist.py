@@ -0,0 +1,105 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+
+class ECListDesyncError(ValueError):
+    """Incremental update that does not match the view
+
+    Raised when an update lists an item unknown to the view without any
+    field, which happens when incremental updates for the same list were
+    requested outside of the view on the same connection.
+
+    """
+
+    pass
+
+class ECListView:
+    """Local mirror of an amuled item list
+
+    Holds a dict() of items keyed like the results of AmuleClient list
+    requests (eg. hashes for partfiles and shared files), each item being a
+    dict() of fields.  Incremental updates (as returned when requesting lists
+    with EC_DETAIL_INC_UPDATE) are merged in with apply().  updated is the
+    time of the last update, or None when the view was never updated.
+
+    """
+
+    def __init__(self, items = None):
+        if items is None:
+            items = {}
+        self.items = items
+        self.updated = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return self.items.has_key(key)
+
+    def __getitem__(self, key):
+        return self.items[key]
+
+    def get(self, key, default = None):
+        return self.items.get(key, default)
+
+    def clear(self):
+        self.items = {}
+        self.updated = None
+
+    def apply(self, update):
+        """Merge a list update into the view
+
+        update must be a dict() as returned by list requests.  All keys present
+        in the view are expected to be present in update; keys that are absent
+        are considered removed.  Item fields present in update replace those in
+        the view, other fields are left untouched.
+
+        Return a (added, changed, removed) tuple of key lists.  Raise
+        ECListDesyncError, leaving the view untouched, when update holds a new
+        item without fields; the view should then be refreshed from a full
+        list.
+
+        """
+
+        items = self.items
+        for key, fields in update.iteritems():
+            if not fields and not items.has_key(key):
+                raise ECListDesyncError("No fields for new item %r" % (key,))
+
+        self.updated = time.time()
+        added = []
+        changed = []
+
+        for key, fields in update.iteritems():
+            item = items.get(key)
+            if item is None:
+                items[key] = dict(fields)
+                added.append(key)
+            elif fields:
+                item.update(fields)
+                changed.append(key)
+
+        removed = []
+        if len(items) != len(update):
+            for key in items.keys():
+                if not update.has_key(key):
+                    del(items[key])
+                    removed.append(key)
+
+        return (added, changed, removed)
@@ -0,0 +1,242 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Request instrumentation
+
+Hooks registered with AmuleClient.add_hook() are notified of each request
+made to amuled with a dict() containing:
+- 'opcode', 'opcode_name': request opcode
+- 'resp_opcode', 'resp_opcode_name': response opcode
+- 'bytes_sent', 'bytes_sent_raw': request size, as sent and uncompressed
+- 'bytes_recv', 'bytes_recv_raw': response size, as received and uncompressed
+- 'tags': response tag count, including subtags
+- 'write_s', 'wait_s', 'read_s', 'decompress_s', 'decode_s': time spent
+  sending the request, waiting for the response header, reading the response
+  body, decompressing it and parsing its tags
+
+Hooks are also notified when list responses are mapped to items by decoder
+plans (see ecdecoder).
+
+ECMetrics is a hook aggregating those into counters and histograms that can be
+exported in the Prometheus text format.
+
+"""
+
+import bisect
+import threading
+
+
+PHASES = ('write', 'wait', 'read', 'decompress', 'decode')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ECHook:
+    """Base request hook, does nothing
+
+    Hooks are called synchronously from the thread making the request and
+    should return quickly.
+
+    """
+
+    def on_request(self, client, info):
+        """Called after each request/response exchange, see module doc"""
+        pass
+
+    def on_decode(self, client, operation, seconds, count):
+        """Called after a list response was mapped to count items"""
+        pass
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(['%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                .replace('"', '\\"').replace('\n', '\\n'))
+                                for k, v in labels])
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class ECMetrics(ECHook):
+    """Request metrics aggregator
+
+    Aggregates request notifications into counters (requests, bytes, tags) by
+    request opcode and into time histograms by request opcode and phase.
+    labels is an optional dict() of labels added to every exported sample (eg.
+    to tell several amuled instances apart).
+
+    An ECMetrics instance may be shared between clients used from different
+    threads.
+
+    """
+
+    COUNTERS = [
+        ('requests_total', None, "EC requests made"),
+        ('bytes_sent_total', 'bytes_sent', "EC bytes sent"),
+        ('bytes_sent_raw_total', 'bytes_sent_raw',
+            "EC bytes sent, before compression"),
+        ('bytes_received_total', 'bytes_recv', "EC bytes received"),
+        ('bytes_received_raw_total', 'bytes_recv_raw',
+            "EC bytes received, after decompression"),
+        ('tags_received_total', 'tags', "EC tags received")
+    ]
+
+    def __init__(self, prefix = 'amule_ec', labels = None,
+                    buckets = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.labels = tuple(sorted((labels or {}).items()))
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all aggregated values"""
+        self._lock.acquire()
+        try:
+            self._counters = {}
+            self._phases = {}
+            self._decode = {}
+            self._items = {}
+        finally:
+            self._lock.release()
+
+    def _histogram(self, table, key):
+        hist = table.get(key)
+        if hist is None:
+            hist = _Histogram(self.buckets)
+            table[key] = hist
+        return hist
+
+    def on_request(self, client, info):
+        opcode = info['opcode_name']
+        self._lock.acquire()
+        try:
+            counters = self._counters.get(opcode)
+            if counters is None:
+                counters = [0] * len(self.COUNTERS)
+                self._counters[opcode] = counters
+            for i, (name, key, doc) in enumerate(self.COUNTERS):
+                if key is None:
+                    counters[i] += 1
+                else:
+                    counters[i] += info[key]
+
+            for phase in PHASES:
+                self._histogram(self._phases, (opcode, phase)).observe(
+                                                    info[phase + '_s'])
+        finally:
+            self._lock.release()
+
+    def on_decode(self, client, operation, seconds, count):
+        self._lock.acquire()
+        try:
+            self._histogram(self._decode, operation).observe(seconds)
+            self._items[operation] = self._items.get(operation, 0) + count
+        finally:
+            self._lock.release()
+
+    def counter(self, name, opcode_name):
+        """Return the value of counter name (eg. 'requests_total')"""
+        self._lock.acquire()
+        try:
+            counters = self._counters.get(opcode_name)
+            if counters is None:
+                return 0
+            for i, (cname, key, doc) in enumerate(self.COUNTERS):
+                if cname == name:
+                    return counters[i]
+            raise KeyError(name)
+        finally:
+            self._lock.release()
+
+    def _histogram_lines(self, name, labels, hist):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, hist.counts):
+            cumulative = cumulative + count
+            lines.append("%s_bucket%s %d" % (name,
+                    _format_labels(labels + (('le', repr(bound)),)),
+                    cumulative))
+        lines.append("%s_bucket%s %d" % (name,
+                    _format_labels(labels + (('le', '+Inf'),)), hist.count))
+        lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                    _format_value(hist.sum)))
+        lines.append("%s_count%s %d" % (name, _format_labels(labels),
+                    hist.count))
+        return lines
+
+    def export(self):
+        """Return aggregated metrics in the Prometheus text format"""
+        lines = []
+        base = self.labels
+        self._lock.acquire()
+        try:
+            opcodes = sorted(self._counters.keys())
+            for i, (name, key, doc) in enumerate(self.COUNTERS):
+                name = "%s_%s" % (self.prefix, name)
+                lines.append("# HELP %s %s" % (name, doc))
+                lines.append("# TYPE %s counter" % name)
+                for opcode in opcodes:
+                    lines.append("%s%s %d" % (name,
+                            _format_labels(base + (('opcode', opcode),)),
+                            self._counters[opcode][i]))
+
+            name = "%s_request_seconds" % self.prefix
+            lines.append("# HELP %s EC request time by phase" % name)
+            lines.append("# TYPE %s histogram" % name)
+            for opcode, phase in sorted(self._phases.keys()):
+                lines.extend(self._histogram_lines(name,
+                            base + (('opcode', opcode), ('phase', phase)),
+                            self._phases[(opcode, phase)]))
+
+            name = "%s_map_seconds" % self.prefix
+            lines.append("# HELP %s EC list mapping time" % name)
+            lines.append("# TYPE %s histogram" % name)
+            for operation in sorted(self._decode.keys()):
+                lines.extend(self._histogram_lines(name,
+                            base + (('operation', operation),),
+                            self._decode[operation]))
+
+            name = "%s_map_items_total" % self.prefix
+            lines.append("# HELP %s EC list items mapped" % name)
+            lines.append("# TYPE %s counter" % name)
+            for operation in sorted(self._items.keys()):
+                lines.append("%s%s %d" % (name,
+                            _format_labels(base + (('operation', operation),)),
+                            self._items[operation]))
+        finally:
+            self._lock.release()
+
+        return "\n".join(lines) + "\n"
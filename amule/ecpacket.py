@@ -16,8 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import struct
+import time
 from cStringIO import StringIO
-import zlib
 
 from eccodes import *
 from ectag import *
@@ -26,19 +26,161 @@ from ecpacketutils import *
 
 class ECUnknownTagtypeError(Exception): pass
 class ECRemainingBytesError(Exception): pass
+class ECFrameTooLargeError(Exception): pass
 
 
+# Chunk size used when reading or decompressing frames piecewise
+_CHUNK = 65536
+
+
+class ECFrameLimits:
+    """Frame size limits
+
+    - max_frame: maximum frame data size, as received (before decompression)
+    - max_appdata: maximum application data size, after decompression
+    - spill_size: frame data larger than this is kept in a memory-mapped
+      temporary file (created in spill_dir) instead of in memory
+
+    None means no limit (or no spilling).
+
+    """
+
+    def __init__(self, max_frame = None, max_appdata = None, spill_size = None,
+                    spill_dir = None):
+        self.max_frame = max_frame
+        self.max_appdata = max_appdata
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir
+
+
+class _SpillBuffer:
+    """Write buffer moving to a temporary file once spill_size is exceeded"""
+
+    def __init__(self, spill_size, spill_dir = None):
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir
+        self.size = 0
+        self._chunks = []
+        self._file = None
+
+    def write(self, data):
+        self.size = self.size + len(data)
+        if self._file is None:
+            self._chunks.append(data)
+            if self.spill_size is not None and self.size > self.spill_size:
+                import tempfile
+                self._file = tempfile.TemporaryFile(dir = self.spill_dir)
+                self._file.write("".join(self._chunks))
+                self._chunks = []
+        else:
+            self._file.write(data)
+
+    def getvalue(self):
+        """Return written data as a string or a read-only mmap object"""
+        if self._file is None:
+            return "".join(self._chunks)
+
+        import mmap
+        self._file.flush()
+        try:
+            return mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def ec_read_data(dbuf, length, limits = None):
+    """Read length bytes of frame data from dbuf
+
+    Data larger than limits.spill_size is returned as a read-only mmap object.
+
+    """
+
+    if limits is None or limits.spill_size is None or \
+            length <= limits.spill_size:
+        return dbuf.read(length)
+
+    out = _SpillBuffer(limits.spill_size, limits.spill_dir)
+    while out.size < length:
+        chunk = dbuf.read(min(_CHUNK, length - out.size))
+        if not chunk:
+            break
+        out.write(chunk)
+    return out.getvalue()
+
+def ec_check_frame(length, limits = None):
+    """Raise ECFrameTooLargeError when length exceeds limits.max_frame"""
+    if limits is not None and limits.max_frame is not None and \
+            length > limits.max_frame:
+        raise ECFrameTooLargeError("Frame too large: %d bytes (max %d)" %
+                                    (length, limits.max_frame))
+
+def ec_frame_appdata(codes, flags, data, limits = None):
+    """Return uncompressed application data from a packet frame
+
+    When limits (an ECFrameLimits) is given, data is decompressed piecewise;
+    ECFrameTooLargeError is raised as soon as more than limits.max_appdata
+    bytes are produced, and data larger than limits.spill_size is returned as
+    a read-only mmap object.
+
+    """
+
+    if not flags & codes.FLAG_ZLIB:
+        if limits is not None and limits.max_appdata is not None and \
+                len(data) > limits.max_appdata:
+            raise ECFrameTooLargeError("Frame too large: %d bytes (max %d)" %
+                                        (len(data), limits.max_appdata))
+        return data
+
+    import zlib
+    if limits is None:
+        return zlib.decompress(data)
+
+    max_size = limits.max_appdata
+    out = _SpillBuffer(limits.spill_size, limits.spill_dir)
+    dobj = zlib.decompressobj()
+    pos = 0
+    length = len(data)
+    while 1:
+        if dobj.unconsumed_tail:
+            chunk = dobj.unconsumed_tail
+        elif pos < length:
+            chunk = data[pos:pos + _CHUNK]
+            pos = pos + _CHUNK
+        else:
+            break
+        out.write(dobj.decompress(chunk, _CHUNK))
+        if max_size is not None and out.size > max_size:
+            raise ECFrameTooLargeError("Uncompressed frame too large: more "
+                                        "than %d bytes" % max_size)
+    out.write(dobj.flush())
+    if max_size is not None and out.size > max_size:
+        raise ECFrameTooLargeError("Uncompressed frame too large: more than "
+                                    "%d bytes" % max_size)
+    return out.getvalue()
+
 class ECPacket:
     def __init__(self, codes, **kwargs):
         self.tags = []
         self.flags = codes.FLAG_BLANK
         self.accept_flags = codes.FLAG_BLANK
         self.opcode = kwargs.get('opcode', codes.OP_NOOP)
+        self.appdata_len = None
 
+        profile = kwargs.get('profile')
+        strings = kwargs.get('strings')
         if kwargs.has_key('rawdata'):
-            self._parse_raw_packet(codes, kwargs['rawdata'])
+            self._parse_raw_packet(codes, kwargs['rawdata'], profile, strings)
         elif kwargs.has_key('buffer'):
-            self._read_raw_packet(codes, kwargs['buffer'])
+            self._read_raw_packet(codes, kwargs['buffer'], profile, strings)
+        elif kwargs.has_key('appdata'):
+            flags, appdata = kwargs['appdata']
+            if isinstance(appdata, str):
+                appdata = StringIO(appdata)
+            else:
+                # Memory-mapped spilled data (see ECFrameLimits)
+                appdata.seek(0)
+            self._parse_appdata(codes, flags, appdata, profile, strings)
 
     def set_flag(self, flag):
         self.flags = self.flags | flag
@@ -78,28 +220,46 @@ class ECPacket:
         else:
             appdata = struct.pack("!BH", self.opcode, len(self.tags))
         appdata = appdata + tagdata
+        self.appdata_len = len(appdata)
 
         if use_zlib:
+            import zlib
             appdata = zlib.compress(appdata)
 
         headdata = headdata + struct.pack("!I", len(appdata))
         return headdata + appdata
 
-    def _parse_raw_packet(self, codes, data):
-        self._read_raw_packet(codes, StringIO(data))
+    def _parse_raw_packet(self, codes, data, profile = None, strings = None):
+        self._read_raw_packet(codes, StringIO(data), profile, strings)
 
-    def _read_raw_packet(self, codes, dbuf):
-        self.flags, msg_len = struct.unpack("!II", dbuf.read(8))
+    def _read_raw_packet(self, codes, dbuf, profile = None, strings = None):
+        flags, msg_len = struct.unpack("!II", dbuf.read(8))
+        if not flags & codes.FLAG_ZLIB and profile is None:
+            # Parse straight from dbuf; profiling needs a seekable buffer
+            self._parse_appdata(codes, flags, dbuf, profile, strings)
+            return
+
+        appdata = ec_frame_appdata(codes, flags, dbuf.read(msg_len))
+        self._parse_appdata(codes, flags, StringIO(appdata), profile, strings)
+
+    def _parse_appdata(self, codes, flags, dbuf, profile = None,
+                        strings = None):
+        """Parse application data from dbuf
+
+        When profile is not None, per tag decoding costs are accounted for in
+        profile (see ecprofile.ECTagProfile).  When strings is not None,
+        string values are interned in it (see ecstrings.ECStringTable).
+
+        """
+
+        self.flags = flags
+        if profile is not None and profile.codes is None:
+            profile.codes = codes
 
         if self.get_flag(codes.FLAG_ACCEPTS):
             self.accept_flags = (self.flags & 0xFF00 ) >> 8
 
         utf8_numbers = self.get_flag(codes.FLAG_UTF8_NUMBERS)
-        use_zlib = self.get_flag(codes.FLAG_ZLIB)
-
-        if use_zlib:
-            data = zlib.decompress(dbuf.read(msg_len))
-            dbuf = StringIO(data)
 
         self.opcode = struct.unpack("!B", dbuf.read(1))[0]
 
@@ -109,6 +269,13 @@ class ECPacket:
             tagcount = struct.unpack("!H", dbuf.read(2))[0]
 
         def parse_tag(buf, utf8_numbers):
+            """Parse a tag from buf
+
+            Return a (tag, length) tuple, length being the tag length as
+            accounted for in its parent tag length.
+
+            """
+
             if utf8_numbers:
                 tagname = ec_read_utf8(buf)
                 tagtype = struct.unpack("!B", buf.read(1))[0]
@@ -119,6 +286,7 @@ class ECPacket:
             has_subtags = tagname & 0x1
             tagname = tagname >> 1
             subtags = []
+            datalen = taglen
 
             if has_subtags:
                 if utf8_numbers:
@@ -127,10 +295,12 @@ class ECPacket:
                     subtagcount = struct.unpack("!H", buf.read(2))[0]
 
                 for j in range(subtagcount):
-                    subtags.append(parse_tag(buf, utf8_numbers))
+                    subtag, sublen = read_tag(buf, utf8_numbers)
+                    subtags.append(subtag)
+                    datalen = datalen - sublen
 
             if tagtype == EC_TAGTYPE_CUSTOM:
-                string = buf.read(taglen)
+                string = buf.read(datalen)
                 tag = ECCustomTag(string, tagname)
             elif tagtype == EC_TAGTYPE_UINT8:
                 tag = ECUInt8Tag(struct.unpack("!B", buf.read(1))[0], tagname)
@@ -141,16 +311,17 @@ class ECPacket:
             elif tagtype == EC_TAGTYPE_UINT64:
                 tag = ECUInt64Tag(struct.unpack("!Q", buf.read(8))[0], tagname)
             elif tagtype == EC_TAGTYPE_STRING:
-                string = ""
-                while 1:
-                    char = buf.read(1)
-                    if char == "\x00":
-                        break
-                    else:
-                        string = string + char
+                string = buf.read(datalen)
+                if string[-1:] == "\x00":
+                    string = string[:-1]
+                if strings is not None:
+                    string = strings.intern(string)
                 tag = ECStringTag(string, tagname)
             elif tagtype == EC_TAGTYPE_DOUBLE:
                 tag = ECDoubleTag(struct.unpack("!d", buf.read(8))[0], tagname)
+            elif tagtype == EC_TAGTYPE_IPV4:
+                ip = struct.unpack("!4BH", buf.read(6))
+                tag = ECIPv4Tag("%d.%d.%d.%d:%d" % ip, tagname)
             elif tagtype == EC_TAGTYPE_HASH16:
                 raw = buf.read(16)
                 val = ''.join(["%02x" % x for x in struct.unpack("!16B", raw)])
@@ -159,33 +330,55 @@ class ECPacket:
                 raise ECUnknownTagtypeError("Unsupported TagType: 0x%x" % tagtype)
 
             tag.subtags = subtags
-            return tag
+            if has_subtags:
+                return (tag, taglen + 9)
+            return (tag, taglen + 7)
+
+        # Costs of tags being parsed, excluding their subtags
+        costs = [[0, 0.0]]
+
+        def profile_tag(buf, utf8_numbers):
+            start_pos = buf.tell()
+            start_t = time.time()
+            costs.append([0, 0.0])
+            tag, length = parse_tag(buf, utf8_numbers)
+            nbytes = buf.tell() - start_pos
+            seconds = time.time() - start_t
+            sub_bytes, sub_seconds = costs.pop()
+            profile.add(tag.name, nbytes - sub_bytes, seconds - sub_seconds)
+            parent = costs[-1]
+            parent[0] = parent[0] + nbytes
+            parent[1] = parent[1] + seconds
+            return (tag, length)
+
+        if profile is None:
+            read_tag = parse_tag
+        else:
+            read_tag = profile_tag
 
         for i in range(tagcount):
-            self.tags.append(parse_tag(dbuf, utf8_numbers))
+            self.tags.append(read_tag(dbuf, utf8_numbers)[0])
 
     def dump(self, codes, with_raw = False):
-        s = "Flags: 0x%02x\n" % self.flags
+        lines = ["Flags: 0x%02x" % self.flags]
         if self.get_flag(codes.FLAG_ACCEPTS):
-            s = s + "Accept flags: 0x%02x\n" % self.accept_flags
-        s = s + "Opcode: 0x%02x\n" % self.opcode
-        s = s + "Tag count: %d\n" % len(self.tags)
-        s = s + "\nTags:\n\n"
+            lines.append("Accept flags: 0x%02x" % self.accept_flags)
+        lines.append("Opcode: 0x%02x (%s)" % (self.opcode,
+                                        codes.opcode_name(self.opcode)))
+        lines.append("Tag count: %d" % len(self.tags))
+        lines.append("\nTags:\n")
 
         for t in self.tags:
-            s = s + t.dump() + "\n"
+            lines.append(t.dump(codes))
 
         if with_raw:
-            s = s + "\nRaw data:\n"
-            raw = self.get_raw_packet(codes)
-            cnt = 0
-            for c in raw:
-                s = s + "%02x" % ord(c)
-                if cnt % 4 == 3:
-                    s = s + " "
-                if cnt % 16 == 15:
-                    s = s + "\n"
-                cnt = cnt + 1
-
-        return s
+            import binascii
+            lines.append("\nRaw data:")
+            raw = binascii.hexlify(self.get_raw_packet(codes))
+            for i in range(0, len(raw), 32):
+                row = raw[i:i + 32]
+                lines.append(" ".join([row[j:j + 8]
+                                        for j in range(0, len(row), 8)]))
+
+        return "\n".join(lines) + "\n"
 
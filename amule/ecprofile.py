@@ -0,0 +1,95 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tag-level decoding cost accounting
+
+An ECTagProfile passed to ECPacket (or enabled with
+AmuleClient.start_tag_profile()) accumulates, for each tag name, the number of
+tags decoded, their encoded size and the time spent decoding them.  Sizes and
+times of tags with subtags do not include their subtags, so that totals add
+up to whole packets.
+
+"""
+
+import threading
+
+
+class ECTagProfile:
+    """Per tag name decoding cost accumulator"""
+
+    def __init__(self, codes = None):
+        self.codes = codes
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget accumulated costs"""
+        self._stats = {}
+
+    def add(self, tagname, nbytes, seconds):
+        """Account for one decoded tag"""
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(tagname)
+            if stats is None:
+                self._stats[tagname] = [1, nbytes, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += nbytes
+                stats[2] += seconds
+        finally:
+            self._lock.release()
+
+    def _name(self, tagname):
+        name = None
+        if self.codes is not None:
+            name = self.codes.tag_name(tagname)
+        return name or "0x%04x" % tagname
+
+    def rows(self, sort = 'bytes'):
+        """Return a list of (tag name, count, bytes, seconds) tuples
+
+        Rows are sorted by decreasing sort value ('count', 'bytes' or
+        'seconds').
+
+        """
+
+        index = {'count': 1, 'bytes': 2, 'seconds': 3}[sort]
+        self._lock.acquire()
+        try:
+            rows = [(self._name(k), v[0], v[1], v[2])
+                        for k, v in self._stats.iteritems()]
+        finally:
+            self._lock.release()
+        rows.sort(key = lambda r: r[index], reverse = True)
+        return rows
+
+    def table(self, sort = 'bytes', limit = None):
+        """Return accumulated costs as a text table, see rows()"""
+        rows = self.rows(sort)
+        total_bytes = sum([r[2] for r in rows]) or 1
+        total_time = sum([r[3] for r in rows]) or 1e-9
+        if limit is not None:
+            rows = rows[:limit]
+
+        lines = ["%-40s %9s %12s %6s %10s %6s" % ("Tag", "Count", "Bytes", "%",
+                                                "Time (s)", "%")]
+        for name, count, nbytes, seconds in rows:
+            lines.append("%-40s %9d %12d %5.1f%% %10.4f %5.1f%%" % (name,
+                    count, nbytes, 100.0 * nbytes / total_bytes, seconds,
+                    100.0 * seconds / total_time))
+        return "\n".join(lines) + "\n"
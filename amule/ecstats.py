@@ -0,0 +1,146 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Statistics tree handling
+
+amuled statistics trees are returned as nested TAG_STATTREE_NODE tags.  They
+are wrapped in ECStatsNode objects that only build child nodes when they are
+accessed.
+
+"""
+
+
+class ECStatsNode(object):
+    """Lazily decoded statistics tree node
+
+    Attributes:
+    - label: node label as sent by amuled
+    - id: node ID (protocol 0x0203) or None
+    - values: list of node values (TAG_STAT_NODE_VALUE subtags)
+    - key: identifier used to match nodes between snapshots (node ID when
+      available, label text before any ':' otherwise)
+    - children: list of child ECStatsNode, built on first access
+
+    """
+
+    __slots__ = ('_tag', '_codes', '_children', 'label', 'id', 'values',
+                    'key')
+
+    def __init__(self, tag, codes):
+        self._tag = tag
+        self._codes = codes
+        self._children = None
+        self.label = tag.value
+
+        node_id = None
+        node_id_tag = getattr(codes, 'TAG_STATTREE_NODEID', None)
+        values = []
+        for st in tag.subtags:
+            if st.name == codes.TAG_STAT_NODE_VALUE:
+                values.append(st.value)
+            elif st.name == node_id_tag:
+                node_id = st.value
+        self.id = node_id
+        self.values = values
+
+        if node_id is not None:
+            self.key = node_id
+        else:
+            self.key = self.label.split(":", 1)[0]
+
+    def _get_children(self):
+        if self._children is None:
+            name = self._codes.TAG_STATTREE_NODE
+            self._children = [ECStatsNode(st, self._codes)
+                                for st in self._tag.subtags if st.name == name]
+        return self._children
+
+    children = property(_get_children)
+
+    def value(self):
+        """Return a (label, values) tuple used to compare nodes"""
+        return (self.label, tuple(self.values))
+
+    def walk(self):
+        """Generate (path, node) tuples for this node and its descendants
+
+        Paths are tuples of keys from this node; sibling nodes sharing a key
+        are told apart by (key, occurrence index) tuples.
+
+        """
+
+        return _walk_child(self, (), self.key)
+
+    def __repr__(self):
+        return "<ECStatsNode %r>" % self.label
+
+
+def _keyed(nodes):
+    """Return (key, node) tuples with unique keys among nodes"""
+    seen = {}
+    ret = []
+    for node in nodes:
+        count = seen.get(node.key, 0)
+        seen[node.key] = count + 1
+        if count:
+            ret.append(((node.key, count), node))
+        else:
+            ret.append((node.key, node))
+    return ret
+
+def _walk_child(child, path, key):
+    path = path + (key,)
+    yield (path, child)
+    for subkey, sub in _keyed(child.children):
+        for item in _walk_child(sub, path, subkey):
+            yield item
+
+def stats_tree_diff(old, new):
+    """Compare two statistics trees
+
+    old and new are root ECStatsNode objects (old may be None).  Return a list
+    of (path, old value, new value) tuples for nodes that changed, values being
+    (label, values) tuples as returned by ECStatsNode.value(), or None for
+    nodes that were added or removed.  Paths are tuples of node keys.
+
+    """
+
+    changes = []
+
+    def compare(path, o, n):
+        if o is None:
+            for p, node in _walk_child(n, path[:-1], path[-1]):
+                changes.append((p, None, node.value()))
+            return
+        if n is None:
+            for p, node in _walk_child(o, path[:-1], path[-1]):
+                changes.append((p, node.value(), None))
+            return
+
+        if o.value() != n.value():
+            changes.append((path, o.value(), n.value()))
+
+        old_children = dict(_keyed(o.children))
+        new_children = _keyed(n.children)
+        for key, child in new_children:
+            compare(path + (key,), old_children.pop(key, None), child)
+        for key, child in _keyed(o.children):
+            if old_children.has_key(key):
+                compare(path + (key,), child, None)
+
+    compare((new.key,), old, new)
+    return changes
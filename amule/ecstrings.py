@@ -0,0 +1,69 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""String handling
+
+String tag values are kept as the raw UTF-8 bytes sent by amuled; use
+ec_text() to get unicode text when needed.
+
+Responses repeat a lot of strings (file names in source name lists, links,
+client software names...).  An ECStringTable passed to ECPacket makes equal
+string values within and across responses share a single object.
+
+"""
+
+
+def ec_text(value, errors = 'replace'):
+    """Decode a raw string value into unicode text"""
+    if value is None:
+        return None
+    return value.decode('utf-8', errors)
+
+
+class ECStringTable:
+    """Bounded string intern table
+
+    Strings are kept in two generations of at most size strings each: when
+    the current generation is full, it replaces the previous one, so strings
+    that keep being seen stay interned while others are eventually dropped.
+
+    """
+
+    def __init__(self, size = 65536):
+        self.size = size
+        self.clear()
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+    def intern(self, value):
+        """Return the interned string equal to value"""
+        ret = self._current.get(value)
+        if ret is not None:
+            return ret
+
+        ret = self._previous.get(value, value)
+        current = self._current
+        current[ret] = ret
+        if len(current) >= self.size:
+            self._previous = current
+            self._current = {}
+        return ret
@@ -60,6 +60,7 @@ class ECTag:
                 data = data + struct.pack("!H", len(self.subtags))
 
             data = data + stdata + selfdata
+            return (data, 9 + taglen)
         else:
             name = self.name << 1
             if utf8_numbers:
@@ -76,15 +77,28 @@ class ECTag:
 
         return (data, 7 + taglen)
 
-    def dump(self):
-        s = "Name: 0x%04x\n" % self.name
+    def size(self):
+        """Return the encoded tag length, without UTF-8 numbers"""
+        size = 7 + self.value_size()
+        if self.subtags:
+            size = size + 2
+            for st in self.subtags:
+                size = size + st.size()
+        return size
+
+    def value_size(self):
+        return len(self.pack())
+
+    def dump(self, codes = None):
+        if codes is not None:
+            s = "Name: 0x%04x (%s)\n" % (self.name, codes.tag_name(self.name))
+        else:
+            s = "Name: 0x%04x\n" % self.name
         s = s + "Type: 0x%02x\n" % self.type
         s = s + "Subtag count: %d\n" % len(self.subtags)
         if len(self.subtags):
             s = s + "----- SUBTAGS : -----\n"
-            sts = ""
-            for st in self.subtags:
-                sts = sts + st.dump()
+            sts = "".join([st.dump(codes) for st in self.subtags])
             s = s + "\n".join(["  " + a for a in sts.split("\n")]).rstrip(" ")
             s = s + "---------------------\n"
         s = s + "Value: %s\n" % repr(self.value)
@@ -97,6 +111,9 @@ class ECCustomTag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_CUSTOM)
         self.value = value
 
+    def value_size(self):
+        return len(self.value)
+
     def pack(self):
         return self.value
 
@@ -106,6 +123,9 @@ class ECUInt8Tag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_UINT8)
         self.value = value
 
+    def value_size(self):
+        return 1
+
     def pack(self):
         return struct.pack("!B", self.value)
 
@@ -115,6 +135,9 @@ class ECUInt16Tag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_UINT16)
         self.value = value
 
+    def value_size(self):
+        return 2
+
     def pack(self):
         return struct.pack("!H", self.value)
 
@@ -124,6 +147,9 @@ class ECUInt32Tag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_UINT32)
         self.value = value
 
+    def value_size(self):
+        return 4
+
     def pack(self):
         return struct.pack("!I", self.value)
 
@@ -133,6 +159,9 @@ class ECUInt64Tag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_UINT64)
         self.value = value
 
+    def value_size(self):
+        return 8
+
     def pack(self):
         return struct.pack("!Q", self.value)
 
@@ -142,6 +171,9 @@ class ECStringTag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_STRING)
         self.value = value
 
+    def value_size(self):
+        return len(self.value) + 1
+
     def pack(self):
         return "%s\x00" % self.value
 
@@ -151,6 +183,9 @@ class ECDoubleTag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_DOUBLE)
         self.value = value
 
+    def value_size(self):
+        return 8
+
     def pack(self):
         return struct.pack("!d", self.value)
 
@@ -160,8 +195,25 @@ class ECHash16Tag(ECTag):
         ECTag.__init__(self, name, EC_TAGTYPE_HASH16)
         self.value = value
 
+    def value_size(self):
+        return 16
+
     def pack(self):
         packed = ""
         for i in range(16):
             packed = packed + "%c" % int(self.value[2 * i:2 * i + 2], 16)
         return packed
+
+
+class ECIPv4Tag(ECTag):
+    def __init__(self, value, name):
+        ECTag.__init__(self, name, EC_TAGTYPE_IPV4)
+        self.value = value
+
+    def value_size(self):
+        return 6
+
+    def pack(self):
+        ip, port = self.value.split(":")
+        return struct.pack("!4BH", *([int(b) for b in ip.split(".")] +
+                                        [int(port)]))
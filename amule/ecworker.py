@@ -0,0 +1,130 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Off-thread decoding of large list responses
+
+ECDecodeWorkers hands raw response frames to a pool of worker processes (or
+threads) that decompress, parse and map them to items.  Results come back in
+the compact form of ECDecoderPlan.decode_compact(), which is cheap to pickle.
+
+With worker processes, decoding does not hold the calling process' global
+interpreter lock, so other threads stay responsive and responses from
+several daemons are decoded in parallel on multiple cores.  Use it with
+AmuleClient.set_decode_workers():
+
+    workers = ECDecodeWorkers(processes = 2)
+    client.set_decode_workers(workers, threshold = 1048576)
+
+"""
+
+import time
+
+from eccodes import ec_get_codes
+from ecpacket import ECPacket, ec_frame_appdata
+from ecdecoder import compile_plan
+from ecstrings import ECStringTable
+
+
+# Compiled plans and string table in the current (worker) process.  Interned
+# strings are only pickled once per result.
+_plans = {}
+_strings = ECStringTable()
+
+
+def _count_tags(tags):
+    count = len(tags)
+    for t in tags:
+        if t.subtags:
+            count = count + _count_tags(t.subtags)
+    return count
+
+def decode_list_frame(version, flags, data, operation, ok_opcodes,
+                        limits = None):
+    """Decode a raw list response frame
+
+    data is the frame application data (after the 8-byte header) and may be
+    compressed; it is decompressed within limits (an ecpacket.ECFrameLimits)
+    when given.  Return a (compact, stats) tuple, compact being a
+    decode_compact() result and stats a dict() holding 'resp_opcode',
+    'bytes_recv_raw', 'tags', 'decompress_s', 'decode_s' and 'map_s'.
+
+    """
+
+    codes = ec_get_codes(version)
+    start = time.time()
+    appdata = ec_frame_appdata(codes, flags, data, limits)
+    decompress_t = time.time()
+    packet = ECPacket(codes, appdata = (flags, appdata), strings = _strings)
+    decode_t = time.time()
+
+    plan = _plans.get((version, operation))
+    if plan is None:
+        plan = compile_plan(codes, operation)
+        _plans[(version, operation)] = plan
+    compact = plan.decode_compact(packet, ok_opcodes)
+    map_t = time.time()
+
+    return (compact, {
+        'resp_opcode': packet.opcode,
+        'bytes_recv_raw': 8 + len(appdata),
+        'tags': _count_tags(packet.tags),
+        'decompress_s': decompress_t - start,
+        'decode_s': decode_t - decompress_t,
+        'map_s': map_t - decode_t
+    })
+
+
+class ECDecodeWorkers:
+    """Pool of list response decoders
+
+    mode is either 'process' (default) or 'thread'; processes is the number
+    of workers (defaults to the number of CPUs).  A pool may be shared
+    between clients.
+
+    """
+
+    def __init__(self, processes = None, mode = 'process'):
+        if mode == 'process':
+            from multiprocessing import Pool
+        elif mode == 'thread':
+            from multiprocessing.pool import ThreadPool as Pool
+        else:
+            raise ValueError("Unknown worker mode: %s" % mode)
+        self.mode = mode
+        self._pool = Pool(processes)
+
+    def submit(self, version, flags, data, operation, ok_opcodes,
+                limits = None):
+        """Start decoding a frame, return an AsyncResult
+
+        The result value is as returned by decode_list_frame().
+
+        """
+
+        return self._pool.apply_async(decode_list_frame,
+                    (version, flags, data, operation, list(ok_opcodes), limits))
+
+    def decode(self, version, flags, data, operation, ok_opcodes,
+                limits = None):
+        """Decode a frame in a worker and wait for the result"""
+        return self.submit(version, flags, data, operation, ok_opcodes,
+                            limits).get()
+
+    def close(self):
+        """Stop workers"""
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,45 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import urllib
+
+
+_HASH_RE = re.compile("^[0-9a-fA-F]{32}$")
+
+
+def parse_ed2k_link(link):
+    """Parse an ed2k file link
+
+    Links look like 'ed2k://|file|name|size|hash|...|/'.  Return a (name,
+    size, hash) tuple, with an unquoted name and a lower case hash, or None
+    if link is not a valid ed2k file link.
+
+    """
+
+    if not link.lower().startswith("ed2k://|file|"):
+        return None
+
+    parts = link.split("|")
+    if len(parts) < 6:
+        return None
+
+    name, size, hash = parts[2:5]
+    if not name or not size.isdigit() or not _HASH_RE.match(hash):
+        return None
+
+    return (urllib.unquote(name), int(size), hash.lower())
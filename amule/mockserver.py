@@ -0,0 +1,665 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-process mock amuled
+
+MockAmuled is a local EC server serving synthetic data, meant to exercise
+AmuleClient without a real amuled (benchmarks, tests, reproducing scale
+issues).  It implements authentication for protocol versions 0x0200 and
+0x0203 (including the salt handshake), and the requests wrapped by
+AmuleClient, including incremental updates.
+
+Example:
+
+    server = MockAmuled('secret', downloads = 10000)
+    host, port = server.start()
+    client = AmuleClient()
+    client.connect(host, port, 'secret')
+    ...
+    server.stop()
+
+"""
+
+import hashlib
+import random
+import SocketServer
+import threading
+import time
+
+from eccodes import *
+from ectag import *
+from ecpacket import ECPacket
+from ed2k import parse_ed2k_link
+
+
+# Item field specs: (item key, tag attribute name, tag class)
+_DOWNLOAD_SPEC = [
+    ('name', 'TAG_PARTFILE_NAME', ECStringTag),
+    ('partmetid', 'TAG_PARTFILE_PARTMETID', ECUInt16Tag),
+    ('size', 'TAG_PARTFILE_SIZE_FULL', ECUInt64Tag),
+    ('size_xfer', 'TAG_PARTFILE_SIZE_XFER', ECUInt64Tag),
+    ('size_done', 'TAG_PARTFILE_SIZE_DONE', ECUInt64Tag),
+    ('speed', 'TAG_PARTFILE_SPEED', ECUInt32Tag),
+    ('status', 'TAG_PARTFILE_STATUS', ECUInt8Tag),
+    ('prio', 'TAG_PARTFILE_PRIO', ECUInt8Tag),
+    ('src_count', 'TAG_PARTFILE_SOURCE_COUNT', ECUInt16Tag),
+    ('src_count_a4af', 'TAG_PARTFILE_SOURCE_COUNT_A4AF', ECUInt16Tag),
+    ('src_count_not_current', 'TAG_PARTFILE_SOURCE_COUNT_NOT_CURRENT',
+        ECUInt16Tag),
+    ('src_count_xfer', 'TAG_PARTFILE_SOURCE_COUNT_XFER', ECUInt16Tag),
+    ('ed2k_link', 'TAG_PARTFILE_ED2K_LINK', ECStringTag),
+    ('cat', 'TAG_PARTFILE_CAT', ECUInt8Tag),
+    ('last_recv', 'TAG_PARTFILE_LAST_RECV', ECUInt32Tag),
+    ('last_seen_comp', 'TAG_PARTFILE_LAST_SEEN_COMP', ECUInt32Tag)
+]
+
+_SHARED_SPEC = [
+    ('name', 'TAG_PARTFILE_NAME', ECStringTag),
+    ('size', 'TAG_PARTFILE_SIZE_FULL', ECUInt64Tag),
+    ('ed2k_link', 'TAG_PARTFILE_ED2K_LINK', ECStringTag),
+    ('prio', 'TAG_PARTFILE_PRIO', ECUInt8Tag),
+    ('xferred', 'TAG_KNOWNFILE_XFERRED', ECUInt64Tag),
+    ('xferred_all', 'TAG_KNOWNFILE_XFERRED_ALL', ECUInt64Tag),
+    ('req_count', 'TAG_KNOWNFILE_REQ_COUNT', ECUInt16Tag),
+    ('req_count_all', 'TAG_KNOWNFILE_REQ_COUNT_ALL', ECUInt32Tag),
+    ('accept_count', 'TAG_KNOWNFILE_ACCEPT_COUNT', ECUInt16Tag),
+    ('accept_count_all', 'TAG_KNOWNFILE_ACCEPT_COUNT_ALL', ECUInt32Tag),
+    ('aich_masterhash', 'TAG_KNOWNFILE_AICH_MASTERHASH', ECStringTag)
+]
+
+_SEARCH_SPEC = [
+    ('name', 'TAG_PARTFILE_NAME', ECStringTag),
+    ('size', 'TAG_PARTFILE_SIZE_FULL', ECUInt64Tag),
+    ('src_count', 'TAG_PARTFILE_SOURCE_COUNT', ECUInt32Tag),
+    ('src_count_xfer', 'TAG_PARTFILE_SOURCE_COUNT_XFER', ECUInt32Tag)
+]
+
+_CLIENT_SPEC = [
+    ('name', 'TAG_CLIENT_NAME', ECStringTag),
+    ('software', 'TAG_CLIENT_SOFTWARE', ECUInt8Tag),
+    ('software_version', 'TAG_CLIENT_SOFT_VER_STR', ECStringTag),
+    ('up_speed', 'TAG_CLIENT_UP_SPEED', ECUInt32Tag),
+    ('upload_session', 'TAG_CLIENT_UPLOAD_SESSION', ECUInt32Tag),
+    ('upload_total', 'TAG_CLIENT_UPLOAD_TOTAL', ECUInt32Tag),
+    ('file_hash', 'TAG_KNOWNFILE', ECHash16Tag)
+]
+
+_SERVER_SPEC = [
+    ('name', 'TAG_SERVER_NAME', ECStringTag),
+    ('desc', 'TAG_SERVER_DESC', ECStringTag),
+    ('ping', 'TAG_SERVER_PING', ECUInt32Tag),
+    ('users', 'TAG_SERVER_USERS', ECUInt32Tag),
+    ('users_max', 'TAG_SERVER_USERS_MAX', ECUInt32Tag),
+    ('files', 'TAG_SERVER_FILES', ECUInt32Tag),
+    ('failed', 'TAG_SERVER_FAILED', ECUInt8Tag)
+]
+
+_PARTFILE_COMMANDS = [
+    'OP_PARTFILE_REMOVE_NO_NEEDED', 'OP_PARTFILE_REMOVE_FULL_QUEUE',
+    'OP_PARTFILE_REMOVE_HIGH_QUEUE', 'OP_PARTFILE_CLEANUP_SOURCES',
+    'OP_PARTFILE_SWAP_A4AF_THIS', 'OP_PARTFILE_SWAP_A4AF_THIS_AUTO',
+    'OP_PARTFILE_SWAP_A4AF_OTHERS', 'OP_PARTFILE_PAUSE', 'OP_PARTFILE_RESUME',
+    'OP_PARTFILE_STOP', 'OP_PARTFILE_PRIO_SET', 'OP_PARTFILE_DELETE',
+    'OP_PARTFILE_SET_CAT'
+]
+
+
+def _hash(prefix, i):
+    return hashlib.md5("%s%d" % (prefix, i)).hexdigest()
+
+def _link(name, size, hash):
+    return "ed2k://|file|%s|%d|%s|/" % (name.replace(" ", "%20"), size, hash)
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """Handle one EC session"""
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self.mock = self.server.mock
+        self.codes = None
+        self.sent = {}
+        self.search_progress = 0
+        self.search_kad = False
+
+    def send(self, packet):
+        mock = self.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock.zlib:
+            packet.set_flag(self.codes.FLAG_ZLIB)
+        if mock.utf8_numbers:
+            packet.set_flag(self.codes.FLAG_UTF8_NUMBERS)
+        self.wfile.write(packet.get_raw_packet(self.codes))
+        self.wfile.flush()
+
+    def reply(self, opcode, tags = ()):
+        packet = ECPacket(self.codes, opcode = opcode)
+        packet.tags.extend(tags)
+        self.send(packet)
+
+    def read(self):
+        return ECPacket(self.codes or ec_get_codes(0x0200),
+                        buffer = self.rfile)
+
+    def authenticate(self):
+        req = self.read()
+        mock = self.mock
+        codes = ec_get_codes(0x0200)
+
+        vers = req.get_tag(codes.TAG_PROTOCOL_VERSION)
+        if req.opcode != codes.OP_AUTH_REQ or vers is None or \
+                vers.value not in mock.versions:
+            self.codes = codes
+            self.reply(codes.OP_AUTH_FAIL)
+            return False
+
+        self.codes = codes = ec_get_codes(vers.value)
+        pass_md5 = hashlib.md5(mock.password).hexdigest()
+
+        if vers.value < 0x0203:
+            expected = pass_md5
+            passwd = req.get_tag(codes.TAG_PASSWD_HASH)
+        else:
+            salt = mock.random.randint(1, 0xFFFFFFFFFFFF)
+            self.reply(codes.OP_AUTH_SALT,
+                        [ECUInt64Tag(salt, codes.TAG_PASSWD_SALT)])
+            salt_md5 = hashlib.md5("%lX" % salt).hexdigest()
+            expected = hashlib.md5(pass_md5 + salt_md5).hexdigest()
+            req = self.read()
+            passwd = req.get_tag(codes.TAG_PASSWD_HASH)
+
+        if passwd is None or passwd.value != expected:
+            self.reply(codes.OP_AUTH_FAIL)
+            return False
+
+        self.reply(codes.OP_AUTH_OK,
+                    [ECStringTag(mock.server_version, codes.TAG_SERVER_VERSION)])
+        return True
+
+    def handle(self):
+        try:
+            if not self.authenticate():
+                return
+        except Exception:
+            # Client disconnected or sent garbage
+            return
+
+        while 1:
+            try:
+                req = self.read()
+            except Exception:
+                return
+
+            self.mock.lock.acquire()
+            try:
+                try:
+                    resp = self.mock.dispatch(self, req)
+                except Exception, e:
+                    resp = ECPacket(self.codes, opcode = self.codes.OP_FAILED)
+                    resp.tags.append(ECStringTag("Mock error: %s" % e,
+                                                    self.codes.TAG_STRING))
+            finally:
+                self.mock.lock.release()
+
+            try:
+                self.send(resp)
+            except Exception:
+                return
+
+    def item_tags(self, list_name, item_tag, tag_class, items, spec,
+                    update, detail = None):
+        """Build item tags for a list response
+
+        When update is True, only fields that changed since the last response
+        for list_name on this session are sent.
+
+        """
+
+        codes = self.codes
+        sent = self.sent.setdefault(list_name, {})
+        tags = []
+        for key, item in items:
+            tag = tag_class(key, getattr(codes, item_tag))
+            last = sent.get(key)
+            if last is None or not update:
+                last = {}
+                sent[key] = last
+            for field, attr, cls in spec:
+                value = item.get(field)
+                if value is None or last.get(field) == value:
+                    continue
+                last[field] = value
+                tag.subtags.append(cls(value, getattr(codes, attr)))
+            if detail is not None:
+                detail(item, tag)
+            tags.append(tag)
+
+        if len(sent) > len(items):
+            keys = dict(items)
+            for key in sent.keys():
+                if not keys.has_key(key):
+                    del(sent[key])
+        return tags
+
+
+class _Server(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Sessions end when clients disconnect, possibly in the middle of a
+        # request; there is nothing to report.
+        pass
+
+
+class MockAmuled:
+    """Mock amuled serving synthetic data
+
+    password:       password expected from clients
+    versions:       supported protocol versions
+    downloads:      number of partfiles in the download queue
+    shared:         number of shared files
+    search_results: number of results for each search
+    stats_nodes:    number of leaf nodes in the statistics tree
+    clients:        number of clients in the upload and wait queues
+    servers:        number of servers in the server list
+    churn:          fraction of partfiles changed on each download list request
+    zlib:           compress responses
+    utf8_numbers:   use UTF-8 numbers in responses
+    latency:        delay (seconds) before each response
+    seed:           random seed for synthetic data
+
+    """
+
+    def __init__(self, password = '', versions = EC_KNOWN_VERSIONS,
+                    downloads = 100, shared = 100, search_results = 100,
+                    stats_nodes = 50, clients = 20, servers = 20,
+                    churn = 0.05, zlib = False, utf8_numbers = False,
+                    latency = 0.0, seed = 0, server_version = '2.2.6-mock'):
+        self.password = password
+        self.versions = versions
+        self.search_results = search_results
+        self.stats_nodes = stats_nodes
+        self.churn = churn
+        self.zlib = zlib
+        self.utf8_numbers = utf8_numbers
+        self.latency = latency
+        self.server_version = server_version
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.log = []
+        self.prefs = {}
+        self.directories = []
+        self._hashing = []
+        self._server = None
+        self._thread = None
+
+        rnd = self.random
+        self.downloads = {}
+        for i in range(downloads):
+            self._add_download(_hash('dl', i), "download %d.avi" % i,
+                                rnd.randint(1 << 20, 1 << 32))
+
+        self.shared = {}
+        for i in range(shared):
+            h = _hash('sh', i)
+            size = rnd.randint(1 << 20, 1 << 32)
+            name = "shared %d.avi" % i
+            self.shared[h] = {
+                'name': name, 'size': size, 'ed2k_link': _link(name, size, h),
+                'prio': 1, 'xferred': 0, 'xferred_all': rnd.randint(0, size),
+                'req_count': 0, 'req_count_all': rnd.randint(0, 1000),
+                'accept_count': 0, 'accept_count_all': rnd.randint(0, 100),
+                'aich_masterhash': "AICH%028d" % i
+            }
+
+        self.clients = {}
+        shared_hashes = self.shared.keys() or [_hash('sh', 0)]
+        for i in range(clients):
+            self.clients[i + 1] = {
+                'name': "peer %d" % i, 'software': 0,
+                'software_version': 'aMule 2.2.6', 'up_speed': 0,
+                'upload_session': 0, 'upload_total': 0,
+                'file_hash': rnd.choice(shared_hashes)
+            }
+
+        self.servers = {}
+        for i in range(servers):
+            self.servers["10.0.%d.%d:4661" % (i / 250, i % 250 + 1)] = {
+                'name': "server %d" % i, 'desc': '',
+                'ping': rnd.randint(10, 500), 'users': rnd.randint(0, 500000),
+                'users_max': 1000000, 'files': rnd.randint(0, 50000000),
+                'failed': rnd.choice([0, 0, 0, 1, 5])
+            }
+
+    def _add_download(self, h, name, size):
+        rnd = self.random
+        self.downloads[h] = {
+            'name': name, 'partmetid': len(self.downloads) % 65536,
+            'size': size, 'size_xfer': 0, 'size_done': rnd.randint(0, size),
+            'speed': 0, 'status': EC_PS_READY, 'prio': EC_PR_NORMAL,
+            'src_count': rnd.randint(0, 100), 'src_count_a4af': 0,
+            'src_count_not_current': 0, 'src_count_xfer': 0,
+            'ed2k_link': _link(name, size, h), 'cat': 0, 'last_recv': 0,
+            'last_seen_comp': int(time.time()), 'stopped': 0,
+            'source_names': [name, name.upper(), "%s (1)" % name]
+        }
+
+    def start(self, host = '127.0.0.1', port = 0):
+        """Start serving in a background thread
+
+        Return the (host, port) address the server listens on.
+
+        """
+
+        server = _Server((host, port), _Handler)
+        server.mock = self
+
+        self._server = server
+        self._thread = threading.Thread(target = server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return server.server_address
+
+    def stop(self):
+        """Stop serving"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def _tick(self):
+        """Randomly change some partfiles"""
+        rnd = self.random
+        active = [h for h, item in self.downloads.iteritems()
+                    if item['status'] == EC_PS_READY]
+        count = int(len(active) * self.churn)
+        for h in rnd.sample(active, min(count, len(active))):
+            item = self.downloads[h]
+            item['speed'] = rnd.randint(0, 200000)
+            item['size_done'] = min(item['size'],
+                                    item['size_done'] + item['speed'])
+            item['src_count_xfer'] = rnd.randint(0, 10)
+
+    def dispatch(self, session, req):
+        """Handle request req on session, return the response packet"""
+        codes = session.codes
+        op = req.opcode
+
+        detail = req.get_tag(codes.TAG_DETAIL_LEVEL)
+        update = detail is not None and detail.value == EC_DETAIL_INC_UPDATE
+
+        def packet(opcode, tags = ()):
+            p = ECPacket(codes, opcode = opcode)
+            p.tags.extend(tags)
+            return p
+
+        if op == codes.OP_STAT_REQ:
+            return packet(codes.OP_STATS, self._stats_tags(codes))
+
+        elif op in (codes.OP_GET_DLOAD_QUEUE, codes.OP_GET_DLOAD_QUEUE_DETAIL):
+            self._tick()
+            wanted = [t.value for t in req.tags if t.name == codes.TAG_PARTFILE]
+            if wanted:
+                items = [(h, self.downloads[h]) for h in wanted
+                            if self.downloads.has_key(h)]
+            else:
+                items = self.downloads.items()
+
+            spec = _DOWNLOAD_SPEC
+            if codes.CURRENT_PROTOCOL_VERSION >= 0x0203:
+                spec = spec + [('stopped', 'TAG_PARTFILE_STOPPED', ECUInt8Tag)]
+
+            names = None
+            if op == codes.OP_GET_DLOAD_QUEUE_DETAIL:
+                def names(item, tag):
+                    st = ECUInt32Tag(len(item['source_names']),
+                                        codes.TAG_PARTFILE_SOURCE_NAMES)
+                    st.subtags = [ECStringTag(n, codes.TAG_PARTFILE_SOURCE_NAMES)
+                                    for n in item['source_names']]
+                    tag.subtags.append(st)
+                list_name = 'dload_detail'
+            else:
+                list_name = 'dload'
+
+            return packet(codes.OP_DLOAD_QUEUE, session.item_tags(list_name,
+                'TAG_PARTFILE', ECHash16Tag, items, spec, update, names))
+
+        elif op == codes.OP_GET_SHARED_FILES:
+            # Files in added directories are "hashed" one per request
+            if self._hashing:
+                h, item = self._hashing.pop(0)
+                self.shared[h] = item
+            return packet(codes.OP_SHARED_FILES, session.item_tags('shared',
+                'TAG_KNOWNFILE', ECHash16Tag, self.shared.items(),
+                _SHARED_SPEC, update))
+
+        elif op in (codes.OP_GET_ULOAD_QUEUE, codes.OP_GET_WAIT_QUEUE):
+            clients = self.clients.items()
+            if op == codes.OP_GET_ULOAD_QUEUE:
+                clients = clients[:len(clients) / 2]
+                resp_op, list_name = codes.OP_ULOAD_QUEUE, 'uload'
+            else:
+                clients = clients[len(clients) / 2:]
+                resp_op, list_name = codes.OP_WAIT_QUEUE, 'wait'
+            for key, item in clients:
+                item['up_speed'] = self.random.randint(0, 50000)
+                item['upload_session'] = item['upload_session'] + \
+                                            item['up_speed']
+                item['upload_total'] = item['upload_total'] + item['up_speed']
+            return packet(resp_op, session.item_tags(list_name, 'TAG_CLIENT',
+                ECUInt32Tag, clients, _CLIENT_SPEC, update))
+
+        elif op == codes.OP_GET_SERVER_LIST:
+            return packet(codes.OP_SERVER_LIST, session.item_tags('servers',
+                'TAG_SERVER', ECIPv4Tag, self.servers.items(), _SERVER_SPEC,
+                update))
+
+        elif op == codes.OP_SERVER_CONNECT:
+            tag = req.get_tag(codes.TAG_SERVER)
+            if tag is not None and self.servers.has_key(tag.value):
+                self.log.append("Connecting to %s" % tag.value)
+                return packet(codes.OP_NOOP)
+            return packet(codes.OP_FAILED)
+
+        elif op == codes.OP_SEARCH_START:
+            # Like amuled, answer OP_FAILED even when the search starts
+            search = req.tags[0].get_subtag(codes.TAG_SEARCH_NAME)
+            if search is None or not search.value:
+                return packet(codes.OP_FAILED, [ECStringTag(
+                    "No search string given", codes.TAG_STRING)])
+            session.search_progress = 0
+            session.search_kad = req.tags[0].value == 2
+            session.sent['search'] = {}
+            return packet(codes.OP_FAILED, [ECStringTag(
+                "Search in progress. Refetch results in a moment!",
+                codes.TAG_STRING)])
+
+        elif op == codes.OP_SEARCH_PROGRESS:
+            session.search_progress = min(100, session.search_progress + 50)
+            # amuled does not report progress for Kad searches
+            progress = session.search_progress
+            if session.search_kad:
+                progress = 0
+            return packet(codes.OP_SEARCH_PROGRESS,
+                [ECUInt32Tag(progress, codes.TAG_SEARCH_STATUS)])
+
+        elif op == codes.OP_SEARCH_RESULTS:
+            count = self.search_results * max(session.search_progress, 10) / 100
+            items = []
+            for i in range(count):
+                items.append((_hash('search', i), {
+                    'name': "result %d.avi" % i, 'size': (i + 1) << 20,
+                    'src_count': i % 50 + session.search_progress / 10,
+                    'src_count_xfer': i % 5
+                }))
+            return packet(codes.OP_SEARCH_RESULTS, session.item_tags('search',
+                'TAG_SEARCHFILE', ECHash16Tag, items, _SEARCH_SPEC, update))
+
+        elif op == codes.OP_SEARCH_STOP:
+            return packet(codes.OP_NOOP)
+
+        elif op == codes.OP_GET_STATSTREE:
+            return packet(codes.OP_STATSTREE, [self._stats_tree(codes)])
+
+        elif op in [getattr(codes, name) for name in _PARTFILE_COMMANDS]:
+            for t in req.tags:
+                self._partfile_cmd(codes, op, t)
+            return packet(codes.OP_NOOP)
+
+        elif op == codes.OP_ADD_LINK:
+            for t in req.tags:
+                parsed = parse_ed2k_link(t.value)
+                if parsed is None:
+                    return packet(codes.OP_FAILED)
+                name, size, h = parsed
+                if not self.downloads.has_key(h):
+                    self._add_download(h, name, size)
+            return packet(codes.OP_NOOP)
+
+        elif op in (codes.OP_GET_LOG, codes.OP_GET_DEBUGLOG,
+                    codes.OP_GET_SERVERINFO, codes.OP_GET_LAST_LOG_ENTRY):
+            if op == codes.OP_GET_LAST_LOG_ENTRY:
+                text = (self.log or [''])[-1]
+            else:
+                text = "\n".join(self.log)
+            resp_op = {
+                codes.OP_GET_DEBUGLOG: codes.OP_DEBUGLOG,
+                codes.OP_GET_SERVERINFO: codes.OP_SERVERINFO
+            }.get(op, codes.OP_LOG)
+            return packet(resp_op, [ECStringTag(text, codes.TAG_STRING)])
+
+        elif op in (codes.OP_RESET_LOG, codes.OP_RESET_DEBUGLOG,
+                    codes.OP_CLEAR_SERVERINFO):
+            if op == codes.OP_RESET_LOG:
+                self.log = []
+            return packet(codes.OP_NOOP)
+
+        elif op == codes.OP_GET_PREFERENCES:
+            tags = []
+            select = req.get_tag(codes.TAG_SELECT_PREFS)
+            mask = select is not None and select.value or 0
+            for bit, tag in self.prefs.iteritems():
+                if mask & bit:
+                    tags.append(tag)
+            return packet(codes.OP_SET_PREFERENCES, tags)
+
+        elif op == codes.OP_SET_PREFERENCES:
+            for t in req.tags:
+                # Section tags are TAG_PREFS_CATEGORIES (0x1100) and up, in
+                # the same order as EC_PREFS_* bits
+                bit = 1 << ((t.name >> 8) - 0x11)
+                self.prefs[bit] = t
+            return packet(codes.OP_NOOP)
+
+        elif op == codes.OP_SHAREDFILES_ADD_DIRECTORY:
+            for t in req.tags:
+                self._add_directory(t.value)
+            return packet(codes.OP_NOOP)
+
+        elif op == codes.OP_SHARED_SET_PRIO:
+            for t in req.tags:
+                item = self.shared.get(t.value)
+                if item is not None and t.subtags:
+                    item['prio'] = t.subtags[0].value
+            return packet(codes.OP_NOOP)
+
+        elif op in (codes.OP_SHAREDFILES_RELOAD, codes.OP_NOOP):
+            return packet(codes.OP_NOOP)
+
+        return packet(codes.OP_FAILED, [ECStringTag(
+            "Unsupported opcode 0x%02x" % op, codes.TAG_STRING)])
+
+    def _add_directory(self, path):
+        """Queue 3 files from a new shared directory for hashing"""
+        if path in self.directories:
+            return
+        self.directories.append(path)
+        for i in range(3):
+            h = _hash(path, i)
+            name = "%s file %d.avi" % (path.rstrip('/').split('/')[-1], i)
+            size = self.random.randint(1 << 20, 1 << 32)
+            self._hashing.append((h, {
+                'name': name, 'size': size, 'ed2k_link': _link(name, size, h),
+                'prio': 1, 'xferred': 0, 'xferred_all': 0, 'req_count': 0,
+                'req_count_all': 0, 'accept_count': 0, 'accept_count_all': 0,
+                'aich_masterhash': "AICH%028d" % (len(self.shared) + i)
+            }))
+
+    def _partfile_cmd(self, codes, op, tag):
+        item = self.downloads.get(tag.value)
+        if item is None:
+            return
+        if op == codes.OP_PARTFILE_DELETE:
+            del(self.downloads[tag.value])
+        elif op in (codes.OP_PARTFILE_PAUSE, codes.OP_PARTFILE_STOP):
+            item['status'] = EC_PS_PAUSED
+            item['speed'] = 0
+            if op == codes.OP_PARTFILE_STOP:
+                item['stopped'] = 1
+        elif op == codes.OP_PARTFILE_RESUME:
+            item['status'] = EC_PS_READY
+            item['stopped'] = 0
+        elif op == codes.OP_PARTFILE_PRIO_SET and tag.subtags:
+            prio = tag.subtags[0].value
+            if prio == EC_PR_AUTO:
+                prio = EC_PR_NORMAL + 10
+            item['prio'] = prio
+        elif op == codes.OP_PARTFILE_SET_CAT and tag.subtags:
+            item['cat'] = tag.subtags[0].value
+
+    def _stats_tags(self, codes):
+        dl_speed = sum([i['speed'] for i in self.downloads.itervalues()])
+        connstate = ECUInt8Tag(3, codes.TAG_CONNSTATE)
+        connstate.subtags.append(ECUInt32Tag(0x7F000001, codes.TAG_CLIENT_ID))
+        return [
+            ECUInt32Tag(0, codes.TAG_STATS_UL_SPEED),
+            ECUInt32Tag(dl_speed, codes.TAG_STATS_DL_SPEED),
+            ECUInt32Tag(0, codes.TAG_STATS_UL_SPEED_LIMIT),
+            ECUInt32Tag(0, codes.TAG_STATS_DL_SPEED_LIMIT),
+            ECUInt32Tag(len(self.clients) / 2, codes.TAG_STATS_UL_QUEUE_LEN),
+            ECUInt32Tag(sum([i['src_count']
+                            for i in self.downloads.itervalues()]),
+                        codes.TAG_STATS_TOTAL_SRC_COUNT),
+            ECUInt32Tag(sum([s['users'] for s in self.servers.itervalues()]),
+                        codes.TAG_STATS_ED2K_USERS),
+            ECUInt32Tag(0, codes.TAG_STATS_KAD_USERS),
+            ECUInt32Tag(sum([s['files'] for s in self.servers.itervalues()]),
+                        codes.TAG_STATS_ED2K_FILES),
+            ECUInt32Tag(0, codes.TAG_STATS_KAD_FILES),
+            connstate
+        ]
+
+    def _stats_tree(self, codes):
+        def node(label, children = (), values = ()):
+            tag = ECStringTag(label, codes.TAG_STATTREE_NODE)
+            tag.subtags = [ECUInt64Tag(v, codes.TAG_STAT_NODE_VALUE)
+                            for v in values] + list(children)
+            return tag
+
+        done = sum([i['size_done'] for i in self.downloads.itervalues()])
+        leaves = [node("Client %d: %d" % (i, self.random.randint(0, 100)))
+                    for i in range(self.stats_nodes)]
+        return node("Statistics", [
+            node("Transfer", [
+                node("Downloaded: %d" % done, values = (done,)),
+                node("Uploaded: 0", values = (0,))
+            ]),
+            node("Clients", leaves)
+        ])
@@ -0,0 +1,117 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+import threading
+
+from amule import AmuleClient
+
+
+class AmuleClientPool:
+    """Pool of connected AmuleClient instances to a single amuled
+
+    Clients are connected on demand, up to size clients at a time.  A client
+    must only be used by one thread at a time; use acquire()/release() or the
+    client() context manager to borrow one.  Request hooks in hooks (see
+    ecmetrics) are registered with each client.
+
+    """
+
+    def __init__(self, host, port, password, size = 4,
+                    client_name = '', client_version = '', hooks = None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._password = password
+        self._client_name = client_name
+        self._client_version = client_version
+        self.hooks = list(hooks or [])
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+        self._idle = []
+
+    def _new_client(self):
+        client = AmuleClient()
+        for hook in self.hooks:
+            client.add_hook(hook)
+        client.connect(self.host, self.port, self._password,
+                        self._client_name, self._client_version)
+        return client
+
+    def acquire(self):
+        """Borrow a connected client, blocking until one is available"""
+        self._slots.acquire()
+        self._lock.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+        finally:
+            self._lock.release()
+
+        try:
+            return self._new_client()
+        except:
+            self._slots.release()
+            raise
+
+    def release(self, client, broken = False):
+        """Give back a borrowed client
+
+        When broken is True (eg. after an IO error), the client is disconnected
+        and a new one will be connected when needed.
+
+        """
+
+        if broken:
+            try:
+                client.disconnect()
+            except:
+                pass
+        else:
+            self._lock.acquire()
+            try:
+                self._idle.append(client)
+            finally:
+                self._lock.release()
+        self._slots.release()
+
+    @contextmanager
+    def client(self):
+        """Context manager borrowing a client for the duration of a block"""
+        client = self.acquire()
+        try:
+            yield client
+        except:
+            self.release(client, True)
+            raise
+        else:
+            self.release(client)
+
+    def close(self):
+        """Disconnect idle clients"""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+        finally:
+            self._lock.release()
+
+        for client in idle:
+            try:
+                client.disconnect()
+            except:
+                pass
@@ -0,0 +1,240 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Search job scheduling
+
+amuled only runs one search at a time per session.  SearchScheduler queues
+search jobs and runs each of them to completion on a session borrowed from
+one of its sources, merging results from all jobs by file hash.
+
+"""
+
+import Queue
+import threading
+import time
+
+from amule import ECError
+
+
+# Search methods (see AmuleClient.search_start())
+SEARCH_LOCAL = 0
+SEARCH_GLOBAL = 1
+SEARCH_KAD = 2
+
+
+class _ClientSource:
+    """Single AmuleClient used as a one-session pool"""
+
+    size = 1
+
+    def __init__(self, client):
+        self._client = client
+
+    def acquire(self):
+        return self._client
+
+    def release(self, client, broken = False):
+        pass
+
+
+class SearchJob:
+    """Search job, as returned by SearchScheduler.submit()
+
+    Attributes:
+    - query, method, options: search_start() arguments
+    - hashes: list of result hashes found by this job
+    - done: True when the job finished
+    - error: exception raised while running the job, or None
+
+    """
+
+    def __init__(self, query, method, options):
+        self.query = query
+        self.method = method
+        self.options = options
+        self.hashes = []
+        self.done = False
+        self.error = None
+
+
+class SearchScheduler:
+    """Run queued searches on several sessions
+
+    sources is a list of AmuleClientPool and/or AmuleClient instances (which
+    may be connected to different amuled).  One worker thread is started per
+    pool slot or client.
+
+    Each job is run until amuled reports 100% progress or timeout seconds
+    elapsed, polling results every interval seconds with incremental
+    updates.  amuled does not report progress for Kad searches, which are
+    considered finished when no result was added or changed for settle
+    seconds instead.  Jobs rejected by amuled (as told by the search_start()
+    message) fail immediately with an ECError.  Results are merged by hash in
+    self.merged; results() streams hashes to consumers as they are first
+    found.
+
+    """
+
+    def __init__(self, sources, timeout = 120, interval = 2.0, settle = 30.0):
+        self.timeout = timeout
+        self.interval = interval
+        self.settle = settle
+        self._lock = threading.Lock()
+        self.merged = {}
+        self._jobs = Queue.Queue()
+        self._out = Queue.Queue()
+        self._pending = 0
+        self._workers = []
+
+        for source in sources:
+            if not hasattr(source, 'acquire'):
+                source = _ClientSource(source)
+            for i in range(source.size):
+                t = threading.Thread(target = self._worker, args = (source,))
+                t.daemon = True
+                t.start()
+                self._workers.append(t)
+
+    def submit(self, query, method, **options):
+        """Queue a search job
+
+        Arguments are passed to AmuleClient.search_start().  Return the
+        SearchJob.
+
+        """
+
+        job = SearchJob(query, method, options)
+        self._lock.acquire()
+        try:
+            self._pending = self._pending + 1
+        finally:
+            self._lock.release()
+        self._jobs.put(job)
+        return job
+
+    def _merge(self, job, items):
+        """Merge items from job into results and stream new hashes
+
+        Return the number of new or changed items in items.
+
+        """
+
+        changed = 0
+        self._lock.acquire()
+        try:
+            for h, fields in items.iteritems():
+                if fields:
+                    changed = changed + 1
+                item = self.merged.get(h)
+                if item is None:
+                    item = dict(fields)
+                    self.merged[h] = item
+                    job.hashes.append(h)
+                    self._out.put((job, h, item))
+                elif fields:
+                    item.update(fields)
+        finally:
+            self._lock.release()
+        return changed
+
+    def _run(self, client, job):
+        ret = client.search_start(job.query, job.method, **job.options)
+        if not ret['ok']:
+            job.error = ECError("Search rejected by amuled: %s" %
+                                    ret.get('message'))
+            return
+
+        last_change = time.time()
+        deadline = last_change + self.timeout
+        try:
+            while 1:
+                time.sleep(self.interval)
+                changed = self._merge(job,
+                                client.get_search_results(update = True))
+                now = time.time()
+                if changed:
+                    last_change = now
+                if now >= deadline:
+                    break
+                if job.method == SEARCH_KAD:
+                    if now - last_change >= self.settle:
+                        break
+                elif client.get_search_progress() >= 100:
+                    break
+        finally:
+            client.search_stop()
+        self._merge(job, client.get_search_results(update = True))
+
+    def _worker(self, source):
+        while 1:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            try:
+                client = source.acquire()
+            except Exception, e:
+                job.error = e
+            else:
+                try:
+                    self._run(client, job)
+                except Exception, e:
+                    job.error = e
+                    source.release(client, True)
+                else:
+                    source.release(client)
+
+            job.done = True
+            self._lock.acquire()
+            try:
+                self._pending = self._pending - 1
+            finally:
+                self._lock.release()
+            self._out.put(None)
+
+    def results(self):
+        """Generate (job, hash, item) tuples as results are found
+
+        Each hash is generated only once, for the first job that found it;
+        item is the merged result dict(), which may be updated later by other
+        jobs.  The generator ends when all submitted jobs are done.
+
+        """
+
+        while 1:
+            try:
+                entry = self._out.get(True, 0.5)
+            except Queue.Empty:
+                entry = None
+            if entry is not None:
+                yield entry
+                continue
+
+            self._lock.acquire()
+            try:
+                finished = self._pending == 0
+            finally:
+                self._lock.release()
+            if finished and self._out.empty():
+                return
+
+    def close(self):
+        """Stop worker threads once queued jobs are done"""
+        for t in self._workers:
+            self._jobs.put(None)
+        for t in self._workers:
+            t.join()
@@ -0,0 +1,119 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk snapshots of decoded amuled lists
+
+A snapshot file holds decoded item lists (eg. download and shared lists)
+along with the identity of the daemon they were fetched from and its version
+string, so that a restarting client can start from a known state.
+
+File layout (all integers in network byte order):
+- magic string 'ECSNAP'
+- format version (uint16)
+- identity length (uint16) and identity string
+- server version length (uint16) and server version string
+- marshalled dict() of lists, each list being a dict() of items
+
+"""
+
+import marshal
+import os
+import struct
+
+
+SNAPSHOT_MAGIC = "ECSNAP"
+SNAPSHOT_FORMAT = 1
+
+
+class ECSnapshotError(Exception): pass
+
+
+def save_snapshot(path, identity, server_version, lists):
+    """Write a snapshot file
+
+    lists is a dict() mapping list names to item dicts.  Items must only
+    contain marshallable values (which is the case for decoded list items).
+    The file is written to a temporary file first and then renamed, so that
+    readers never see a partially written snapshot.
+
+    """
+
+    identity = str(identity)
+    server_version = str(server_version)
+
+    head = SNAPSHOT_MAGIC + struct.pack("!H", SNAPSHOT_FORMAT)
+    head = head + struct.pack("!H", len(identity)) + identity
+    head = head + struct.pack("!H", len(server_version)) + server_version
+
+    tmppath = "%s.tmp%d" % (path, os.getpid())
+    f = open(tmppath, "wb")
+    try:
+        f.write(head)
+        marshal.dump(lists, f)
+    finally:
+        f.close()
+    os.rename(tmppath, path)
+
+def _read_string(f):
+    length = struct.unpack("!H", f.read(2))[0]
+    value = f.read(length)
+    if len(value) != length:
+        raise ECSnapshotError("Truncated snapshot file")
+    return value
+
+def load_snapshot(path, identity = None, server_version = None):
+    """Read a snapshot file
+
+    The header is read and checked first: when identity and/or
+    server_version are given, they must match those recorded in the snapshot,
+    and lists are only unmarshalled (straight from the file) if they do.
+
+    Return the dict() of lists stored in the snapshot, or None if the file
+    does not exist or does not match.  Raise ECSnapshotError if the file is not
+    a valid snapshot.
+
+    """
+
+    try:
+        f = open(path, "rb")
+    except IOError:
+        return None
+
+    try:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ECSnapshotError("Not a snapshot file")
+        fmt = struct.unpack("!H", f.read(2))[0]
+        if fmt != SNAPSHOT_FORMAT:
+            raise ECSnapshotError("Unknown snapshot format: %d" % fmt)
+
+        snap_identity = _read_string(f)
+        snap_version = _read_string(f)
+
+        if identity is not None and snap_identity != str(identity):
+            return None
+        if server_version is not None and \
+                snap_version != str(server_version):
+            return None
+
+        try:
+            return marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            raise ECSnapshotError("Corrupted snapshot data")
+    except struct.error:
+        raise ECSnapshotError("Truncated snapshot file")
+    finally:
+        f.close()
@@ -0,0 +1,281 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Live amuled monitor
+
+    amule-top [options] [password@]host[:port] ...
+
+Connects once to each daemon and shows its status, top transfers and upload
+and waiting queue changes.  Lists are only ever refreshed with incremental
+updates (EC_DETAIL_INC_UPDATE), so each refresh only transfers what changed.
+Each daemon is polled by its own thread over a single connection, so watching
+several daemons does not add load to any of them.  EC traffic generated by the
+monitor itself is shown for each daemon.
+
+"""
+
+import optparse
+import sys
+import threading
+import time
+
+from amule import AmuleClient
+from ecmetrics import ECHook
+
+
+DEFAULT_PORT = 4712
+
+
+def _rate(value):
+    for unit in ('B', 'kB', 'MB'):
+        if value < 1024:
+            return "%.1f%s/s" % (value, unit)
+        value = value / 1024.0
+    return "%.1fGB/s" % value
+
+def parse_daemon(spec, password = ''):
+    """Parse a [password@]host[:port] daemon specification
+
+    Return a (host, port, password) tuple.
+
+    """
+
+    if '@' in spec:
+        password, spec = spec.rsplit('@', 1)
+    port = DEFAULT_PORT
+    if spec.startswith('['):
+        host, rest = spec[1:].split(']', 1)
+        if rest.startswith(':'):
+            port = int(rest[1:])
+    elif spec.count(':') == 1:
+        host, port = spec.split(':')
+        port = int(port)
+    else:
+        host = spec
+    return (host, port, password)
+
+
+class _TrafficCounter(ECHook):
+    """Hook counting EC bytes exchanged by a client"""
+
+    def __init__(self):
+        self.total = 0
+
+    def on_request(self, client, info):
+        self.total = self.total + info['bytes_sent'] + info['bytes_recv']
+
+
+class DaemonMonitor:
+    """Monitor state for a single amuled
+
+    refresh() fetches status and incremental list updates; it is called
+    periodically by run() from a dedicated thread.  Other attributes are
+    read by the display thread.
+
+    """
+
+    def __init__(self, host, port, password, interval = 2.0):
+        self.host = host
+        self.port = port
+        self.name = "%s:%d" % (host, port)
+        self.interval = interval
+        self.status = {}
+        self.changes = {}
+        self.error = None
+        self.ec_rate = 0.0
+        self.updated = None
+        self._password = password
+        self._client = None
+        self._traffic = _TrafficCounter()
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        client = AmuleClient()
+        client.add_hook(self._traffic)
+        client.connect(self.host, self.port, self._password, 'amule-top')
+        self._client = client
+
+    def refresh(self):
+        """Fetch status and list updates, reconnecting when needed"""
+        if self._client is None:
+            self._connect()
+
+        client = self._client
+        try:
+            self.status = client.get_server_status()
+            changes = {}
+            for name, update in (('downloads', client.update_download_view),
+                                 ('uploads', client.update_upload_view),
+                                 ('waiting', client.update_wait_view)):
+                added, changed, removed = update()
+                changes[name] = (len(added), len(changed), len(removed))
+            self.changes = changes
+        except:
+            self._client = None
+            try:
+                client.disconnect()
+            except:
+                pass
+            raise
+
+        now = time.time()
+        if self._last is not None:
+            last_time, last_total = self._last
+            self.ec_rate = (self._traffic.total - last_total) / \
+                            max(now - last_time, 1e-6)
+        self._last = (now, self._traffic.total)
+        self.updated = now
+        self.error = None
+
+    def run(self):
+        while not self._stop.isSet():
+            try:
+                self.refresh()
+            except Exception, e:
+                self.error = str(e) or e.__class__.__name__
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target = self.run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._client is not None:
+            try:
+                self._client.disconnect()
+            except:
+                pass
+            self._client = None
+
+    def downloads(self):
+        if self._client is None:
+            return []
+        return self._client.downloads.items.values()
+
+    def uploads(self):
+        if self._client is None:
+            return []
+        return self._client.uploads.items.values()
+
+    def render(self, top = 10):
+        """Return display lines for this daemon"""
+        head = "== %s ==" % self.name
+        client = self._client
+        if client is not None:
+            head = "%s  protocol 0x%04x  EC traffic %s" % (head,
+                        client.protocol_version, _rate(self.ec_rate))
+        lines = [head]
+        if self.error:
+            lines.append("  error: %s" % self.error)
+        if client is None or self.updated is None:
+            return lines
+
+        s = self.status
+        lines.append("  DL %s  UL %s  upload queue %s  sources %s  "
+                     "ed2k users %s  kad users %s" % (
+                        _rate(s.get('dl_speed') or 0),
+                        _rate(s.get('ul_speed') or 0),
+                        s.get('ul_queue_len', '-'),
+                        s.get('total_src_count', '-'),
+                        s.get('ed2k_users', '-'), s.get('kad_users', '-')))
+
+        counts = []
+        for name, view in (('downloads', client.downloads),
+                           ('uploads', client.uploads),
+                           ('waiting', client.waiting)):
+            added, changed, removed = self.changes.get(name, (0, 0, 0))
+            counts.append("%s %d (+%d ~%d -%d)" % (name, len(view), added,
+                                                    changed, removed))
+        lines.append("  " + "  ".join(counts))
+
+        downloads = [d for d in self.downloads() if d.get('speed')]
+        downloads.sort(key = lambda d: d['speed'], reverse = True)
+        for d in downloads[:top]:
+            done = 0.0
+            if d.get('size'):
+                done = 100.0 * (d.get('size_done') or 0) / d['size']
+            lines.append("  DL %10s %5.1f%%  %s" % (_rate(d['speed']), done,
+                                                    d.get('name', '')))
+
+        uploads = [u for u in self.uploads() if u.get('up_speed')]
+        uploads.sort(key = lambda u: u['up_speed'], reverse = True)
+        for u in uploads[:top]:
+            lines.append("  UL %10s         %s (%s)" % (_rate(u['up_speed']),
+                            u.get('file_name', ''), u.get('name', '')))
+
+        return lines
+
+
+def main(argv = None):
+    parser = optparse.OptionParser(
+                usage = "%prog [options] [password@]host[:port] ...")
+    parser.add_option("-p", "--password", default = '',
+                        help = "default EC password")
+    parser.add_option("-i", "--interval", type = "float", default = 2.0,
+                        help = "refresh interval in seconds [%default]")
+    parser.add_option("-n", "--top", type = "int", default = 10,
+                        help = "number of transfers shown [%default]")
+    parser.add_option("-b", "--batch", action = "store_true", default = False,
+                        help = "do not clear the screen between refreshes")
+    parser.add_option("-c", "--count", type = "int", default = 0,
+                        help = "exit after count refreshes (0: never)")
+    options, args = parser.parse_args(argv)
+    if not args:
+        args = ['localhost']
+
+    monitors = []
+    for spec in args:
+        try:
+            host, port, password = parse_daemon(spec, options.password)
+        except ValueError:
+            parser.error("invalid daemon: %s" % spec)
+        monitors.append(DaemonMonitor(host, port, password, options.interval))
+
+    for m in monitors:
+        m.start()
+
+    count = 0
+    try:
+        while 1:
+            time.sleep(options.interval)
+            lines = [time.strftime("amule-top - %H:%M:%S")]
+            for m in monitors:
+                lines.append("")
+                lines.extend(m.render(options.top))
+            if not options.batch:
+                sys.stdout.write("\x1b[H\x1b[2J")
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+
+            count = count + 1
+            if options.count and count >= options.count:
+                break
+    except KeyboardInterrupt:
+        pass
+
+    for m in monitors:
+        m.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name = 'amule',
@@ -37,5 +37,11 @@ setup(
     author_email = 'joyard.nicolas@gmail.com',
     url = 'http://www.mnkey.ney/avhes/',
 
-    packages = ['amule']
+    packages = ['amule'],
+
+    entry_points = {
+        'console_scripts': [
+            'amule-top = amule.top:main'
+        ]
+    }
 )
@@ -0,0 +1,148 @@
+# This file is part of the Python aMule client library.
+#
+# Copyright (C) 2009  Nicolas Joyard <joyard.nicolas@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""AmuleClient tests against the mock amuled
+
+Run from the top directory with:
+
+    python -m unittest discover tests
+
+"""
+
+import time
+import unittest
+
+from amule import AmuleClient
+from amule.eclist import ECListView, ECListDesyncError
+from amule.ecpacket import ECFrameTooLargeError
+from amule.mockserver import MockAmuled
+from amule.search import SearchScheduler
+
+
+PASSWORD = 'secret'
+
+
+class MockTestCase(unittest.TestCase):
+    mock_options = {}
+
+    def setUp(self):
+        self.mock = MockAmuled(PASSWORD, **self.mock_options)
+        self.host, self.port = self.mock.start()
+        self.client = self.connect()
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.mock.stop()
+
+    def connect(self):
+        client = AmuleClient()
+        client.connect(self.host, self.port, PASSWORD)
+        return client
+
+
+class ListViewTest(MockTestCase):
+    mock_options = {'downloads': 20}
+
+    def test_desync_refetches_full_list(self):
+        # Incremental update made outside of the view on the same connection
+        self.client.get_download_list(update = True)
+        added, changed, removed = self.client.update_download_view()
+        self.assertEqual(len(added), 20)
+        for item in self.client.downloads.items.itervalues():
+            self.assertTrue(item.get('ed2k_link'))
+
+    def test_desync_leaves_view_untouched(self):
+        view = ECListView({'a': {'size': 1}})
+        self.assertRaises(ECListDesyncError, view.apply,
+                            {'a': {'size': 2}, 'b': {'size': 3}, 'c': {}})
+        self.assertEqual(view.items, {'a': {'size': 1}})
+        self.assertEqual(view.updated, None)
+
+
+class LogTest(MockTestCase):
+
+    def test_unchanged_log_yields_nothing(self):
+        self.client.server_connect('10.0.0.1:4661')
+        lines = list(self.client.tail_log(debug = True, serverinfo = True))
+        self.assertEqual(len(lines), 3)
+        for i in range(2):
+            self.assertEqual(list(self.client.tail_log(debug = True,
+                                                    serverinfo = True)), [])
+
+    def test_new_lines_only(self):
+        self.client.server_connect('10.0.0.1:4661')
+        list(self.client.tail_log())
+        self.client.server_connect('10.0.0.2:4661')
+        lines = list(self.client.tail_log())
+        self.assertEqual(len(lines), 1)
+        self.assertTrue('10.0.0.2' in lines[0][1])
+
+
+class SearchTest(MockTestCase):
+
+    def test_rejected_search(self):
+        self.assertEqual(self.client.search_start('', 0)['ok'], False)
+        self.assertEqual(self.client.search_start('file', 0)['ok'], True)
+
+    def test_rejected_job_fails_immediately(self):
+        scheduler = SearchScheduler([self.client], timeout = 30,
+                                    interval = 0.05)
+        start = time.time()
+        job = scheduler.submit('', 0)
+        list(scheduler.results())
+        scheduler.close()
+        self.assertTrue(job.error is not None)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_kad_job_settles(self):
+        scheduler = SearchScheduler([self.client], timeout = 30,
+                                    interval = 0.05, settle = 0.3)
+        start = time.time()
+        job = scheduler.submit('file', 2)
+        list(scheduler.results())
+        scheduler.close()
+        self.assertEqual(job.error, None)
+        self.assertTrue(job.hashes)
+        self.assertTrue(time.time() - start < 5)
+
+
+class ConnectionTest(MockTestCase):
+
+    def test_frame_too_large_during_connect(self):
+        client = AmuleClient()
+        client.set_frame_limits(max_frame = 4)
+        self.assertRaises(ECFrameTooLargeError, client.connect, self.host,
+                            self.port, PASSWORD)
+        client.disconnect()
+
+    def test_disconnect_twice(self):
+        client = self.connect()
+        client.disconnect()
+        client.disconnect()
+
+
+class SharedFilesTest(MockTestCase):
+    mock_options = {'shared': 10}
+
+    def test_reload_wait_requires_settle(self):
+        self.assertRaises(ValueError, self.client.reload_shared_files, True)
+        self.assertEqual(self.client.reload_shared_files(True, 0.1,
+                                    timeout = 5, interval = 0.05), True)
+
+
+if __name__ == '__main__':
+    unittest.main()